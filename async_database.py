@@ -0,0 +1,126 @@
+"""
+异步数据访问层
+AsyncSignInDatabase提供与SignInDatabase相同的方法，但全部是协程：
+数据库调用在专用线程池中执行，不会阻塞事件循环；每个工作线程从连接池取得自己的连接。
+各方法的参数与SignInDatabase相同，另外都接受timeout参数（秒）。
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import SignInDatabase
+
+
+class AsyncSignInDatabase:
+    def __init__(self, db_path='sign_in.db', max_workers=4, timeout=None, shards=1, backend=None):
+        """
+        初始化异步数据访问层
+        :param db_path: 数据库文件路径，默认当前目录下的sign_in.db
+        :param max_workers: 执行数据库调用的线程数，默认4
+        :param timeout: 每次调用的默认超时时间（秒），默认不限制
+        :param shards: 分片数量，默认1
+        :param backend: 自定义存储后端（可选）
+        """
+        self.timeout = timeout
+        self.db = SignInDatabase(db_path, shards=shards, backend=backend)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="async-db")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _run(self, method, *args, timeout=None, **kwargs):
+        """
+        在线程池中执行SignInDatabase的方法
+        超时或协程被取消时，会中断工作线程上正在执行的SQL，尚未开始的调用直接放弃
+        :param method: SignInDatabase的方法
+        :param timeout: 本次调用的超时时间（秒），默认使用初始化时的timeout
+        :return: 方法返回值
+        """
+        state = {'cancelled': False, 'connections': None}
+        lock = threading.Lock()
+
+        def call():
+            with lock:
+                if state['cancelled']:
+                    return None
+                # 记录工作线程使用的连接，取消时用于中断
+                state['connections'] = [pool.connection() for pool in self.db.backend.pools()]
+            try:
+                return method(*args, **kwargs)
+            finally:
+                with lock:
+                    state['connections'] = None
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, call)
+        try:
+            return await asyncio.wait_for(future, timeout if timeout is not None else self.timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            with lock:
+                state['cancelled'] = True
+                for conn in state['connections'] or ():
+                    conn.interrupt()
+            raise
+
+    async def add_user(self, username, email=None, phone=None, timezone=None, timeout=None):
+        return await self._run(self.db.add_user, username, email, phone, timezone, timeout=timeout)
+
+    async def get_user_by_id(self, user_id, timeout=None):
+        return await self._run(self.db.get_user_by_id, user_id, timeout=timeout)
+
+    async def get_user_by_username(self, username, timeout=None):
+        return await self._run(self.db.get_user_by_username, username, timeout=timeout)
+
+    async def update_user(self, user_id, username=None, email=None, phone=None, timezone=None, timeout=None):
+        return await self._run(self.db.update_user, user_id, username, email, phone, timezone, timeout=timeout)
+
+    async def delete_user(self, user_id, timeout=None):
+        return await self._run(self.db.delete_user, user_id, timeout=timeout)
+
+    async def get_all_users(self, timeout=None):
+        return await self._run(self.db.get_all_users, timeout=timeout)
+
+    async def add_sign_record(self, user_id, timeout=None):
+        return await self._run(self.db.add_sign_record, user_id, timeout=timeout)
+
+    async def add_sign_records_bulk(self, records, chunk_size=10000, timeout=None):
+        return await self._run(self.db.add_sign_records_bulk, records, chunk_size, timeout=timeout)
+
+    async def user_today(self, user_id, timeout=None):
+        return await self._run(self.db.user_today, user_id, timeout=timeout)
+
+    async def get_timezones(self, timeout=None):
+        return await self._run(self.db.get_timezones, timeout=timeout)
+
+    async def get_sign_status(self, user_id, timeout=None):
+        return await self._run(self.db.get_sign_status, user_id, timeout=timeout)
+
+    async def get_sign_history(self, user_id, limit=30, timeout=None):
+        return await self._run(self.db.get_sign_history, user_id, limit, timeout=timeout)
+
+    async def get_consecutive_sign_days(self, user_id, timeout=None):
+        return await self._run(self.db.get_consecutive_sign_days, user_id, timeout=timeout)
+
+    async def get_longest_streak(self, user_id, timeout=None):
+        return await self._run(self.db.get_longest_streak, user_id, timeout=timeout)
+
+    async def get_sign_calendar(self, user_id, year, month=None, timeout=None):
+        return await self._run(self.db.get_sign_calendar, user_id, year, month, timeout=timeout)
+
+    async def get_all_sign_records(self, timeout=None):
+        return await self._run(self.db.get_all_sign_records, timeout=timeout)
+
+    async def get_overdue_users(self, threshold_days=2, as_of=None, timezones=None, timeout=None):
+        return await self._run(self.db.get_overdue_users, threshold_days, as_of, timezones, timeout=timeout)
+
+    async def close(self):
+        """
+        等待正在执行的调用结束，然后关闭线程池和数据库连接
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown, True)
+        self.db.close()
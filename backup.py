@@ -0,0 +1,124 @@
+"""
+在线备份
+使用SQLite备份API（sqlite3.Connection.backup）复制数据库：每步只复制少量页面，
+步与步之间暂停一下，签到等写操作最多只需等待一步，不需要停止应用。
+备份先写入临时文件，完整性校验通过后才改为正式文件名，并按数量轮换旧备份。
+
+用法：
+    paths = backup_all(db.backend, "backups", keep=7)
+也可以用 python manage.py backup --dir backups --keep 7
+"""
+
+import datetime
+import os
+import re
+import sqlite3
+
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 7
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.05
+
+
+def backup_database(db_path, dest_path, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP, verify=True):
+    """
+    在线备份一个数据库文件
+    :param db_path: 源数据库文件路径
+    :param dest_path: 备份文件路径
+    :param pages: 每步复制的页数，默认256
+    :param sleep: 每步之间暂停的秒数，默认0.05
+    :param verify: 是否对备份执行完整性校验，默认True
+    :return: 备份文件路径
+    """
+    tmp_path = dest_path + ".tmp"
+    try:
+        source = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            # 其他连接在步与步之间写入时，备份会从头重新开始，签到频繁时可能永远完不成。
+            # WAL模式下先在源连接上开启读事务，整个备份都复制同一个快照，不会重新开始，
+            # 而且读事务不阻塞写入（备份期间检查点无法越过该快照，WAL文件会暂时变大）
+            if source.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            dest = sqlite3.connect(tmp_path)
+            try:
+                source.backup(dest, pages=pages, sleep=sleep)
+                # 源库使用WAL模式，备份改为普通日志模式，成为不依赖-wal文件的单个文件
+                dest.execute("PRAGMA journal_mode=DELETE")
+                if verify:
+                    result = [row[0] for row in dest.execute("PRAGMA integrity_check")]
+                    if result != ["ok"]:
+                        raise sqlite3.DatabaseError("备份完整性校验失败: " + "; ".join(result))
+            finally:
+                dest.close()
+        finally:
+            source.close()
+        os.replace(tmp_path, dest_path)
+        return dest_path
+    except (sqlite3.Error, OSError) as e:
+        print(f"备份数据库失败: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def backup_name(db_path, when=None):
+    """
+    生成备份文件名：<数据库文件名>-YYYYMMDD-HHMMSS.db
+    :param db_path: 源数据库文件路径
+    :param when: 备份时间（datetime.datetime），默认现在
+    :return: 文件名
+    """
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return f"{stem}-{(when or datetime.datetime.now()).strftime('%Y%m%d-%H%M%S')}.db"
+
+
+def list_backups(backup_dir, db_path):
+    """
+    列出某个数据库的全部备份
+    :param backup_dir: 备份目录
+    :param db_path: 源数据库文件路径
+    :return: 备份文件路径列表，从旧到新
+    """
+    if not os.path.isdir(backup_dir):
+        return []
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    pattern = re.compile(re.escape(stem) + r"-\d{8}-\d{6}\.db$")
+    # 文件名中的时间戳可以直接按字符串排序
+    return [os.path.join(backup_dir, name) for name in sorted(os.listdir(backup_dir)) if pattern.match(name)]
+
+
+def rotate_backups(backup_dir, db_path, keep=BACKUP_KEEP):
+    """
+    只保留最新的keep个备份，删除更早的备份
+    :param backup_dir: 备份目录
+    :param db_path: 源数据库文件路径
+    :param keep: 保留的备份数，默认7
+    :return: 被删除的备份文件路径列表
+    """
+    backups = list_backups(backup_dir, db_path)
+    removed = backups[:-keep] if keep > 0 else backups
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def backup_all(backend, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP):
+    """
+    备份存储后端的所有分片并轮换旧备份
+    :param backend: 存储后端（如SignInDatabase.backend）
+    :param backup_dir: 备份目录，默认backups
+    :param keep: 每个分片保留的备份数，默认7
+    :param pages: 每步复制的页数，默认256
+    :param sleep: 每步之间暂停的秒数，默认0.05
+    :return: 新备份的文件路径列表
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    # 同一次备份的各分片使用相同的时间戳
+    when = datetime.datetime.now()
+    paths = []
+    for pool in backend.pools():
+        dest_path = os.path.join(backup_dir, backup_name(pool.db_path, when))
+        paths.append(backup_database(pool.db_path, dest_path, pages, sleep))
+        rotate_backups(backup_dir, pool.db_path, keep)
+    return paths
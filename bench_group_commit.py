@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+组提交签到基准测试
+模拟早高峰：多个线程同时为不同用户签到，比较逐条提交与组提交每秒完成的签到数
+用法：python bench_group_commit.py [--users 2000] [--threads 16] [--durability FULL]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from database import SignInDatabase
+from group_commit import GroupCommitWriter, DURABILITY_LEVELS
+
+
+def prepare(db_path, users):
+    """
+    创建基准测试数据库和用户
+    :return: SignInDatabase
+    """
+    db = SignInDatabase(db_path)
+    with db.backend.pools()[0].transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO users (username, email) VALUES (?, ?)",
+            ((f"bench{i}", f"bench{i}@example.com") for i in range(users))
+        )
+    return db
+
+
+def run_threads(user_ids, threads, sign_in):
+    """
+    用多个线程并发签到
+    :return: 耗时（秒）
+    """
+    chunks = [user_ids[i::threads] for i in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(chunk):
+        barrier.wait()
+        for user_id in chunk:
+            sign_in(user_id)
+
+    workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    return time.perf_counter() - start
+
+
+def bench_direct(db_path, users, threads, durability):
+    """
+    逐条提交：每次签到一个事务
+    """
+    db = prepare(db_path, users)
+    user_ids = list(range(1, users + 1))
+    pool = db.backend.pools()[0]
+    local = threading.local()
+
+    def sign_in(user_id):
+        # 每个线程的连接使用与组提交相同的持久性级别
+        if not getattr(local, "ready", False):
+            pool.connection().execute(f"PRAGMA synchronous={durability}")
+            local.ready = True
+        db.add_sign_record(user_id)
+
+    elapsed = run_threads(user_ids, threads, sign_in)
+    db.close()
+    return elapsed
+
+
+def bench_group(db_path, users, threads, durability, max_batch, max_delay):
+    """
+    组提交：签到进入队列，由写线程批量提交
+    """
+    db = prepare(db_path, users)
+    user_ids = list(range(1, users + 1))
+    writer = GroupCommitWriter(db.backend, max_batch=max_batch, max_delay=max_delay, durability=durability)
+    elapsed = run_threads(user_ids, threads, writer.sign_in)
+    writer.close()
+    batches = writer.batches
+    db.close()
+    return elapsed, batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="组提交签到基准测试")
+    parser.add_argument("--users", type=int, default=2000, help="签到用户数，默认2000")
+    parser.add_argument("--threads", type=int, default=16, help="并发线程数，默认16")
+    parser.add_argument("--durability", default="FULL", choices=DURABILITY_LEVELS, help="持久性级别，默认FULL")
+    parser.add_argument("--max-batch", type=int, default=256, help="每次组提交最多包含的签到数，默认256")
+    parser.add_argument("--max-delay", type=float, default=0.005, help="组提交最长等待时间（秒），默认0.005")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        direct = bench_direct(os.path.join(tmp, "direct.db"), args.users, args.threads, args.durability)
+        group, batches = bench_group(os.path.join(tmp, "group.db"), args.users, args.threads,
+                                     args.durability, args.max_batch, args.max_delay)
+
+    print(f"用户数 {args.users}，线程数 {args.threads}，持久性 {args.durability}")
+    print(f"逐条提交: {direct:.2f} 秒，{args.users / direct:.0f} 次签到/秒")
+    print(f"组提交:   {group:.2f} 秒，{args.users / group:.0f} 次签到/秒（{batches} 次提交）")
+    print(f"提升: {direct / group:.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
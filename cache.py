@@ -0,0 +1,106 @@
+"""
+进程内LRU缓存
+容量有上限，超出时淘汰最久未使用的条目；每个条目在TTL秒后过期。
+读取数据库前先记下generation()，写入缓存时带上它：
+期间如果发生过失效，说明读到的可能是旧数据，这次写入会被丢弃。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=300.0):
+        """
+        初始化缓存
+        :param maxsize: 最多缓存的条目数，默认1024
+        :param ttl: 条目有效期（秒），默认300秒，None表示不过期
+        """
+        if maxsize < 1:
+            raise ValueError("缓存容量必须大于0")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def generation(self):
+        """
+        获取当前的失效代数，读取数据库前调用，写入缓存时传给put
+        :return: 失效代数
+        """
+        return self._generation
+
+    def get(self, key, default=None):
+        """
+        读取缓存，命中时把条目移到最近使用的位置
+        :param key: 缓存键
+        :param default: 未命中时的返回值
+        :return: 缓存的值
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, generation=None):
+        """
+        写入缓存
+        :param key: 缓存键
+        :param value: 缓存的值
+        :param generation: 读取数据前的失效代数（可选），期间发生过失效时不写入
+        :return: 是否写入
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            expires = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def invalidate(self, *keys):
+        """
+        删除指定的缓存条目
+        :param keys: 缓存键
+        """
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        """
+        清空缓存（命中统计保留）
+        """
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        """
+        获取缓存统计
+        :return: 包含hits、misses、size、maxsize的字典
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize
+            }
@@ -1,72 +1,1256 @@
 import sqlite3
+import contextlib
 import datetime
+import functools
+import heapq
+import itertools
 import os
+import re
+import time
+import zoneinfo
+
+import sign_bitmap
+from cache import LRUCache
+from instrumentation import Instrumentation
+from models import User, SignRecord, UserStatus, LeaderboardEntry
+from storage import SQLiteBackend, ShardedSQLiteBackend
+
+
+# 签到日期以整数天数（自1970-01-01起的天数）存储，连续天数的计算都是整数加减
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# 数据库结构版本，记录在 PRAGMA user_version 中
+SCHEMA_VERSION = 8
+
+# 引用users表的子表，删除用户时级联删除
+CASCADE_TABLES = ('sign_records', 'user_stats', 'sign_bitmaps', 'sign_month_summaries', 'reminders_sent')
+
+# 签到记录归档的默认保留期（天）：更早的记录折叠为按月汇总
+ARCHIVE_HORIZON_DAYS = 400
+
+# 每次连续未签到每个渠道最多尝试发送的次数；失败后第n次重试至少间隔 REMINDER_RETRY_DELAY * 2^(n-1) 秒
+REMINDER_MAX_ATTEMPTS = 3
+REMINDER_RETRY_DELAY = 1800
+# 领取后超过该时间（秒）仍未记录结果的发送（进程在发送途中退出）视为失败，可以重新领取
+REMINDER_PENDING_TIMEOUT = 900
+
+# 当前时间（Unix秒）的SQL表达式，用于user_stats.updated_at
+_NOW_SECONDS = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def date_to_day(value):
+    """
+    把日期转换为整数天数
+    :param value: datetime.date、datetime.datetime、YYYY-MM-DD字符串或整数天数
+    :return: 自1970-01-01起的天数
+    """
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    elif isinstance(value, str):
+        value = datetime.date.fromisoformat(value)
+    elif isinstance(value, int):
+        return value
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def local_now(timezone=None, now=None):
+    """
+    计算某个时区的当前时间
+    :param timezone: IANA时区名（如Asia/Shanghai），None表示服务器本地时区
+    :param now: 当前时间（带时区的datetime.datetime），默认现在
+    :return: 带时区的datetime.datetime
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    if timezone is None:
+        return now.astimezone()
+    return now.astimezone(_zone(timezone))
+
+
+def local_today(timezone=None, now=None):
+    """
+    计算某个时区的今天
+    :param timezone: IANA时区名（如Asia/Shanghai），None表示服务器本地时区
+    :param now: 当前时间（带时区的datetime.datetime），默认现在
+    :return: datetime.date
+    """
+    return local_now(timezone, now).date()
+
+
+def earliest_today(now=None):
+    """
+    所有时区中最早的今天（UTC-12），用于清理过期连续天数等全局计算：
+    只要有任何时区还处在前一天，连续签到就不能算作中断
+    :param now: 当前时间（带时区的datetime.datetime），默认现在
+    :return: datetime.date
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return (now.astimezone(datetime.timezone.utc) - datetime.timedelta(hours=12)).date()
+
+
+def validate_timezone(timezone):
+    """
+    校验时区名
+    :param timezone: IANA时区名，None或空字符串表示服务器本地时区
+    :return: 时区名，空字符串转换为None
+    """
+    if not timezone:
+        return None
+    try:
+        _zone(timezone)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"无效的时区: {timezone}")
+    return timezone
+
+
+@functools.lru_cache(maxsize=None)
+def _zone(timezone):
+    return zoneinfo.ZoneInfo(timezone)
+
+
+def day_to_date(day):
+    """
+    把整数天数转换为日期
+    :param day: 自1970-01-01起的天数，可以为None
+    :return: datetime.date，day为None时返回None
+    """
+    if day is None:
+        return None
+    return datetime.date.fromordinal(day + EPOCH_ORDINAL)
+
+
+def upgrade_schema(cursor):
+    """
+    创建索引和用户统计表，并把旧版本数据库迁移到当前结构
+    需在users、sign_records表创建之后调用
+    :param cursor: 数据库游标
+    """
+    cursor.execute("PRAGMA user_version")
+    version = cursor.fetchone()[0]
+
+    if version < 1:
+        # 版本1：签到日期由 YYYY-MM-DD 文本改为整数天数
+        # 旧版webapp建的表把sign_date声明为TEXT，需先重建为INTEGER列，否则换算出的天数又会被存成文本
+        convert_sign_date_column(cursor)
+        cursor.execute('''
+            UPDATE sign_records
+            SET sign_date = CAST(julianday(sign_date) - julianday('1970-01-01') AS INTEGER)
+            WHERE typeof(sign_date) = 'text'
+        ''')
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_stats'"
+        )
+        if cursor.fetchone():
+            cursor.execute('''
+                UPDATE user_stats
+                SET last_sign_date = CAST(julianday(last_sign_date) - julianday('1970-01-01') AS INTEGER)
+                WHERE typeof(last_sign_date) = 'text'
+            ''')
+
+    cascaded = False
+    if version < 5:
+        # 版本5：子表的外键改为 ON DELETE CASCADE（重建表后，下面会重新创建索引、视图和触发器）
+        cascaded = cascade_user_foreign_keys(cursor)
+
+    # 归档的月度签到汇总，以及合并热数据和归档数据的签到日期视图
+    # 统计重算和历史查询都读取视图，不需要关心记录是否已被归档
+    ensure_sign_archive(cursor)
+
+    deduplicated = []
+    if version < 8:
+        # 版本8：webapp建的表没有 (user_id, sign_date) 唯一约束，删除重复的签到记录后把覆盖索引改为唯一索引
+        deduplicated = remove_duplicate_sign_records(cursor)
+        cursor.execute("DROP INDEX IF EXISTS idx_sign_records_user_date")
+
+    # 按用户查询签到日期的覆盖索引，同时保证每个用户每天只有一条签到记录（webapp建的表没有唯一约束）
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_sign_records_user_date ON sign_records (user_id, sign_date)"
+    )
+
+    ensure_user_stats(cursor)
+
+    # 用户时区：定时任务按时区分组检查，需要按时区查找用户
+    ensure_user_timezone(cursor)
+
+    # 提醒发送记录：每次连续未签到每个渠道最多提醒一次
+    ensure_reminder_ledger(cursor)
+
+    # 排行榜：连续签到天数的索引和分布表
+    ensure_leaderboard(cursor)
+    if cascaded:
+        # 重建表时丢弃了孤立的统计行，分布表需要重新统计
+        rebuild_streak_histogram(cursor)
+
+    # 签到位图表：每个用户每年一行，用于日历和连续天数的位运算
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sign_bitmaps (
+            user_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            bits BLOB NOT NULL,
+            PRIMARY KEY (user_id, year),
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    if version < 2:
+        # 版本2：新增签到位图表，从签到记录回填
+        rebuild_sign_bitmaps(cursor)
+
+    if version < 6:
+        # 版本6：webapp写入的签到记录没有计算连续未签到天数，整体重算一次
+        recompute_missed(cursor)
+    elif deduplicated:
+        recompute_missed(cursor, deduplicated)
+    if deduplicated:
+        # 统计中的签到总数把重复记录也计算在内，需要重算
+        rebuild_user_stats(cursor, deduplicated)
+
+    if version < SCHEMA_VERSION:
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def convert_sign_date_column(cursor):
+    """
+    把签到记录表中声明为文本类型的sign_date列重建为INTEGER列
+    文本亲和性的列会把写入的整数转换为文本存储，只能按原建表语句新建表、
+    复制数据（同时把 YYYY-MM-DD 文本换算为整数天数）后替换原表；原表的索引和引用它的视图随之删除，
+    由upgrade_schema随后重新创建
+    :param cursor: 数据库游标
+    :return: 是否重建了表
+    """
+    cursor.execute("PRAGMA table_info(sign_records)")
+    columns = cursor.fetchall()
+    declared = next((row[2] for row in columns if row[1] == 'sign_date'), '').upper()
+    # SQLite按声明类型确定亲和性：含CHAR、CLOB或TEXT的为文本亲和性
+    if not any(word in declared for word in ('CHAR', 'CLOB', 'TEXT')):
+        return False
+
+    cursor.execute("DROP VIEW IF EXISTS all_sign_days")
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'sign_records'")
+    create_sql = cursor.fetchone()[0]
+    create_sql = re.sub(
+        r'^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?["`\[]?sign_records["`\]]?',
+        'CREATE TABLE sign_records_int', create_sql, count=1, flags=re.IGNORECASE
+    )
+    create_sql = re.sub(r'\bsign_date\s+\w+(\s*\([^)]*\))?', 'sign_date INTEGER', create_sql, count=1)
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'sign_records'")
+    sequence = cursor.fetchone()
+
+    names = [row[1] for row in columns]
+    values = [
+        "CASE WHEN typeof(sign_date) = 'text' "
+        "THEN CAST(julianday(sign_date) - julianday('1970-01-01') AS INTEGER) ELSE sign_date END"
+        if name == 'sign_date' else name
+        for name in names
+    ]
+    cursor.execute(create_sql)
+    cursor.execute(
+        f"INSERT INTO sign_records_int ({', '.join(names)}) SELECT {', '.join(values)} FROM sign_records"
+    )
+    cursor.execute("DROP TABLE sign_records")
+    cursor.execute("ALTER TABLE sign_records_int RENAME TO sign_records")
+    if sequence:
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'sign_records'")
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('sign_records', ?)", (sequence[0],))
+    return True
+
+
+def remove_duplicate_sign_records(cursor):
+    """
+    删除重复的签到记录：同一用户同一天保留最早的一条，与已归档日期重复的热数据记录也删除
+    :param cursor: 数据库游标
+    :return: 删除了记录的用户ID列表
+    """
+    duplicate = '''
+        EXISTS (
+            SELECT 1 FROM sign_records d
+            WHERE d.user_id = sign_records.user_id AND d.sign_date = sign_records.sign_date
+              AND d.record_id < sign_records.record_id
+        ) OR EXISTS (
+            SELECT 1 FROM sign_month_summaries s
+            WHERE s.user_id = sign_records.user_id
+              AND s.month_start <= sign_records.sign_date AND s.month_start > sign_records.sign_date - 31
+              AND (s.day_bits >> (sign_records.sign_date - s.month_start)) & 1
+        )
+    '''
+    cursor.execute(f"SELECT DISTINCT user_id FROM sign_records WHERE {duplicate}")
+    user_ids = [row[0] for row in cursor.fetchall()]
+    if user_ids:
+        cursor.execute(f"DELETE FROM sign_records WHERE {duplicate}")
+    return user_ids
+
+
+def cascade_user_foreign_keys(cursor):
+    """
+    把已有子表引用users的外键改为 ON DELETE CASCADE
+    SQLite不能修改约束，只能按原建表语句新建表、复制数据（丢弃已没有对应用户的孤立行）后替换原表；
+    原表的索引和触发器、以及引用它的视图会随之删除，需由调用方重新创建
+    :param cursor: 数据库游标
+    :return: 是否重建了表
+    """
+    pending = []
+    for table in CASCADE_TABLES:
+        cursor.execute(f"PRAGMA foreign_key_list({table})")
+        if any(row[2] == 'users' and row[6].upper() != 'CASCADE' for row in cursor.fetchall()):
+            pending.append(table)
+    if not pending:
+        return False
+
+    # 视图引用了签到记录表，重命名表之前必须先删除
+    cursor.execute("DROP VIEW IF EXISTS all_sign_days")
+    for table in pending:
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        create_sql = cursor.fetchone()[0]
+        create_sql = re.sub(
+            rf'^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?["`\[]?{table}["`\]]?',
+            f'CREATE TABLE {table}_cascade', create_sql, count=1, flags=re.IGNORECASE
+        )
+        create_sql = re.sub(
+            r'REFERENCES\s+["`\[]?users["`\]]?\s*\(\s*user_id\s*\)',
+            r'\g<0> ON DELETE CASCADE', create_sql, flags=re.IGNORECASE
+        )
+        # 保留自增序号，避免删除表后重新使用已分配过的记录ID
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+        sequence = cursor.fetchone()
+
+        cursor.execute(create_sql)
+        cursor.execute(
+            f"INSERT INTO {table}_cascade SELECT * FROM {table} WHERE user_id IN (SELECT user_id FROM users)"
+        )
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {table}_cascade RENAME TO {table}")
+        if sequence:
+            cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, sequence[0]))
+    return True
+
+
+def ensure_sign_archive(cursor):
+    """
+    创建月度签到汇总表（sign_month_summaries）和签到日期视图（all_sign_days）
+    :param cursor: 数据库游标
+    """
+    # 每个用户每月一行：day_bits第i位表示当月第i+1天已签到
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sign_month_summaries (
+            user_id INTEGER NOT NULL,
+            month_start INTEGER NOT NULL,
+            day_bits INTEGER NOT NULL,
+            sign_count INTEGER NOT NULL,
+            longest_run INTEGER NOT NULL,
+            PRIMARY KEY (user_id, month_start),
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+
+    # 热数据直接取自签到记录；归档数据按位展开为日期，record_id和consecutive_missed为NULL
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS all_sign_days AS
+        WITH RECURSIVE offsets (n) AS (
+            SELECT 0 UNION ALL SELECT n + 1 FROM offsets WHERE n < 30
+        )
+        SELECT user_id, sign_date, record_id, consecutive_missed
+        FROM sign_records
+        UNION ALL
+        SELECT s.user_id, s.month_start + o.n, NULL, NULL
+        FROM sign_month_summaries s
+        JOIN offsets o ON (s.day_bits >> o.n) & 1
+    ''')
+
+
+def archive_cutoff(horizon_days=ARCHIVE_HORIZON_DAYS, as_of=None):
+    """
+    计算归档分界日期：只归档完整的月份，分界为 as_of - horizon_days 所在月的第一天
+    :param horizon_days: 保留期（天）
+    :param as_of: 计算基准日期（datetime.date），默认今天
+    :return: 分界日期（整数天数），早于该日期的签到记录会被归档
+    """
+    boundary = (as_of or datetime.date.today()) - datetime.timedelta(days=horizon_days)
+    return date_to_day(boundary.replace(day=1))
+
+
+def compact_sign_records(cursor, cutoff_day):
+    """
+    把早于分界日期的签到记录折叠为按月汇总并从签到记录表删除
+    已有汇总的月份会与新折叠的日期合并，可以重复执行
+    :param cursor: 数据库游标
+    :param cutoff_day: 分界日期（整数天数），应为某月第一天
+    :return: (删除的签到记录数, 写入的月度汇总行数)
+    """
+    conn = cursor.connection
+    conn.create_function("bit_count", 1, lambda bits: bin(bits).count("1"), deterministic=True)
+    conn.create_function("longest_run", 1, sign_bitmap.longest_run, deterministic=True)
+
+    # month_start：签到日期所在月第一天的整数天数
+    cursor.execute('''
+        INSERT INTO sign_month_summaries (user_id, month_start, day_bits, sign_count, longest_run)
+        SELECT user_id, month_start, bits, bit_count(bits), longest_run(bits)
+        FROM (
+            SELECT user_id, month_start, SUM(1 << (sign_date - month_start)) AS bits
+            FROM (
+                SELECT DISTINCT user_id, sign_date,
+                       CAST(strftime('%s', sign_date * 86400, 'unixepoch', 'start of month') AS INTEGER) / 86400
+                           AS month_start
+                FROM sign_records
+                WHERE sign_date < ?
+            )
+            GROUP BY user_id, month_start
+        ) WHERE 1
+        ON CONFLICT (user_id, month_start) DO UPDATE SET
+            day_bits = day_bits | excluded.day_bits,
+            sign_count = bit_count(day_bits | excluded.day_bits),
+            longest_run = longest_run(day_bits | excluded.day_bits)
+    ''', (cutoff_day,))
+    months = cursor.rowcount
+
+    cursor.execute("DELETE FROM sign_records WHERE sign_date < ?", (cutoff_day,))
+    return cursor.rowcount, months
+
+
+def ensure_user_timezone(cursor):
+    """
+    为用户表添加时区列（IANA时区名，NULL表示服务器本地时区）及其索引
+    :param cursor: 数据库游标
+    """
+    cursor.execute("PRAGMA table_info(users)")
+    if 'timezone' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE users ADD COLUMN timezone TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_timezone ON users (timezone)")
+
+
+def ensure_reminder_ledger(cursor):
+    """
+    创建提醒发送记录表（reminders_sent）
+    一次连续未签到（从最后一次签到的第二天开始，记为episode_start_date）每个渠道一行，
+    发送前先插入一行领取发送权，唯一键保证多个进程同时检查时也只有一个进程发送
+    :param cursor: 数据库游标
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reminders_sent (
+            user_id INTEGER NOT NULL,
+            episode_start_date INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (user_id, episode_start_date, channel),
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("PRAGMA table_info(reminders_sent)")
+    if 'attempts' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE reminders_sent ADD COLUMN attempts INTEGER NOT NULL DEFAULT 1")
+
+
+def claim_reminder(cursor, user_id, episode_start, channel):
+    """
+    领取一次提醒的发送权（需在发送前单独提交）
+    记录不存在时插入pending记录；以下记录在尝试次数未达到REMINDER_MAX_ATTEMPTS时可以重新领取：
+    上次发送失败（failed）且已过退避时间的，以及领取后超过REMINDER_PENDING_TIMEOUT仍未记录结果（pending）的
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :param episode_start: 本次连续未签到的第一天（整数天数，即最后签到日期+1）
+    :param channel: 提醒渠道，如email、sms
+    :return: 是否领取成功，False表示已有进程发送过、正在发送、等待重试或已放弃
+    """
+    # sent_at为最近一次领取或记录结果的时间
+    cursor.execute(f'''
+        INSERT INTO reminders_sent (user_id, episode_start_date, channel, status, attempts)
+        VALUES (?, ?, ?, 'pending', 1)
+        ON CONFLICT (user_id, episode_start_date, channel) DO UPDATE
+        SET status = 'pending', sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+        WHERE attempts < {REMINDER_MAX_ATTEMPTS} AND (
+            (status = 'failed' AND
+             datetime(sent_at, '+' || ({REMINDER_RETRY_DELAY} << (attempts - 1)) || ' seconds') <= CURRENT_TIMESTAMP)
+            OR (status = 'pending' AND
+                datetime(sent_at, '+{REMINDER_PENDING_TIMEOUT} seconds') <= CURRENT_TIMESTAMP)
+        )
+    ''', (user_id, episode_start, channel))
+    return cursor.rowcount > 0
+
+
+def finish_reminder(cursor, user_id, episode_start, channel, success):
+    """
+    记录提醒的发送结果
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :param episode_start: 本次连续未签到的第一天（整数天数）
+    :param channel: 提醒渠道
+    :param success: 是否发送成功，失败的记录在退避时间后可以重新领取
+    """
+    cursor.execute(
+        "UPDATE reminders_sent SET status = ?, sent_at = CURRENT_TIMESTAMP "
+        "WHERE user_id = ? AND episode_start_date = ? AND channel = ?",
+        ('sent' if success else 'failed', user_id, episode_start, channel)
+    )
+
+
+def fetch_user_today(cursor, user_id):
+    """
+    读取用户所在时区的今天
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :return: datetime.date，用户不存在时按服务器本地时区计算
+    """
+    cursor.execute("SELECT timezone FROM users WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    return local_today(row[0] if row else None)
+
+
+def fetch_timezones(cursor):
+    """
+    读取用户使用的全部时区（按时区索引去重）
+    :param cursor: 数据库游标
+    :return: 时区名列表，None表示服务器本地时区
+    """
+    cursor.execute("SELECT DISTINCT timezone FROM users")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def overdue_users_query(threshold_days=2, as_of=None, timezones=None):
+    """
+    构造逾期用户查询：连续未签到天数达到阈值的用户（从未签到过的用户不计入）
+    :param threshold_days: 连续未签到天数阈值
+    :param as_of: 计算基准日期（datetime.date），默认今天
+    :param timezones: 只查询这些时区的用户（可选，None表示服务器本地时区），默认全部用户
+    :return: (查询语句, 查询参数)，结果列为用户ID、用户名、邮箱、电话、最后签到日期、连续未签到天数
+    """
+    as_of = date_to_day(as_of or datetime.date.today())
+    # 连续未签到天数 = 基准日期 - 最后签到日期 - 1
+    cutoff = as_of - threshold_days - 1
+    zone_filter = ""
+    zone_params = ()
+    if timezones is not None:
+        names = tuple(timezone for timezone in timezones if timezone is not None)
+        conditions = [f"u.timezone IN ({', '.join('?' * len(names))})"] if names else []
+        if None in timezones:
+            conditions.append("u.timezone IS NULL")
+        zone_filter = f"AND ({' OR '.join(conditions) or '0'})"
+        zone_params = names
+    # 在最近签到日期索引上做范围查找，只读取逾期用户
+    return f"""
+        SELECT u.user_id, u.username, u.email, u.phone, st.last_sign_date,
+               ? - st.last_sign_date - 1
+        FROM user_stats st
+        JOIN users u ON u.user_id = st.user_id
+        WHERE st.last_sign_date <= ? {zone_filter}
+    """, (as_of, cutoff) + zone_params
+
+
+def ensure_user_stats(cursor):
+    """
+    创建用户统计表（user_stats），首次创建时从签到记录回填
+    :param cursor: 数据库游标
+    """
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_stats'"
+    )
+    existed = cursor.fetchone() is not None
+
+    # 用户统计表：每个用户一行，随签到同步维护，统计查询只需读取一行
+    # updated_at为统计最近一次变化的时间（Unix秒），用作HTTP缓存的版本号
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            current_streak INTEGER NOT NULL DEFAULT 0,
+            longest_streak INTEGER NOT NULL DEFAULT 0,
+            last_sign_date INTEGER,
+            total_signs INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("PRAGMA table_info(user_stats)")
+    if 'updated_at' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE user_stats ADD COLUMN updated_at INTEGER")
+
+    # 定时检测按最近签到日期范围查找逾期用户
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_last_sign_date ON user_stats (last_sign_date)"
+    )
+
+    if not existed:
+        rebuild_user_stats(cursor)
+
+
+def ensure_leaderboard(cursor):
+    """
+    创建排行榜所需的索引、连续天数分布表（streak_histogram）及其触发器
+    首次创建分布表时从用户统计表回填
+    :param cursor: 数据库游标
+    """
+    # 按连续天数倒序取前N名，直接顺序读取索引
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_current ON user_stats (current_streak DESC, user_id, last_sign_date)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_longest ON user_stats (longest_streak DESC, user_id)"
+    )
+    # 只包含连续签到未清零的用户，清理过期连续天数时只扫描这部分
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_stats_live ON user_stats (last_sign_date) WHERE current_streak > 0"
+    )
+
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'streak_histogram'"
+    )
+    existed = cursor.fetchone() is not None
+
+    # 连续天数分布：每种连续天数有多少用户，排名 = 1 + 天数更多的用户数之和
+    # 分布表的行数只与最大连续天数有关，与用户数无关
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS streak_histogram (
+            kind TEXT NOT NULL,
+            streak INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            PRIMARY KEY (kind, streak)
+        ) WITHOUT ROWID
+    ''')
+
+    # 用户统计表的每次变化都由触发器同步到分布表（webapp直接写库也会被覆盖）
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_insert AFTER INSERT ON user_stats
+        BEGIN
+            INSERT INTO streak_histogram (kind, streak, users) VALUES ('current', NEW.current_streak, 1)
+                ON CONFLICT (kind, streak) DO UPDATE SET users = users + 1;
+            INSERT INTO streak_histogram (kind, streak, users) VALUES ('longest', NEW.longest_streak, 1)
+                ON CONFLICT (kind, streak) DO UPDATE SET users = users + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_delete AFTER DELETE ON user_stats
+        BEGIN
+            UPDATE streak_histogram SET users = users - 1
+                WHERE kind = 'current' AND streak = OLD.current_streak;
+            UPDATE streak_histogram SET users = users - 1
+                WHERE kind = 'longest' AND streak = OLD.longest_streak;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_update
+        AFTER UPDATE OF current_streak, longest_streak ON user_stats
+        BEGIN
+            UPDATE streak_histogram SET users = users - 1
+                WHERE kind = 'current' AND streak = OLD.current_streak
+                  AND OLD.current_streak IS NOT NEW.current_streak;
+            INSERT INTO streak_histogram (kind, streak, users)
+                SELECT 'current', NEW.current_streak, 1
+                WHERE OLD.current_streak IS NOT NEW.current_streak
+                ON CONFLICT (kind, streak) DO UPDATE SET users = users + 1;
+            UPDATE streak_histogram SET users = users - 1
+                WHERE kind = 'longest' AND streak = OLD.longest_streak
+                  AND OLD.longest_streak IS NOT NEW.longest_streak;
+            INSERT INTO streak_histogram (kind, streak, users)
+                SELECT 'longest', NEW.longest_streak, 1
+                WHERE OLD.longest_streak IS NOT NEW.longest_streak
+                ON CONFLICT (kind, streak) DO UPDATE SET users = users + 1;
+        END
+    ''')
+
+    if not existed:
+        rebuild_streak_histogram(cursor)
+        expire_stale_streaks(cursor, date_to_day(earliest_today()))
+
+
+def rebuild_streak_histogram(cursor):
+    """
+    根据用户统计表重新统计连续天数分布
+    :param cursor: 数据库游标
+    """
+    cursor.execute("DELETE FROM streak_histogram")
+    cursor.execute('''
+        INSERT INTO streak_histogram (kind, streak, users)
+        SELECT 'current', current_streak, COUNT(*) FROM user_stats GROUP BY current_streak
+        UNION ALL
+        SELECT 'longest', longest_streak, COUNT(*) FROM user_stats GROUP BY longest_streak
+    ''')
+
+
+def expire_stale_streaks(cursor, as_of_day):
+    """
+    把已经中断（最后签到早于前一天）的当前连续天数清零，使排行榜只统计仍在延续的连续签到
+    :param cursor: 数据库游标
+    :param as_of_day: 基准日期（整数天数）
+    :return: 清零的用户数
+    """
+    cursor.execute(
+        "UPDATE user_stats SET current_streak = 0 WHERE current_streak > 0 AND last_sign_date < ?",
+        (as_of_day - 1,)
+    )
+    return cursor.rowcount
+
+
+# 排行榜的排序依据（同时是分布表的kind）及对应的用户统计表列
+LEADERBOARD_KINDS = {
+    'current': 'current_streak',
+    'longest': 'longest_streak'
+}
+
+
+def fetch_leaderboard(cursor, by='longest', limit=10, as_of_day=None):
+    """
+    读取连续签到天数排行榜的前N名
+    :param cursor: 数据库游标
+    :param by: 排序依据，current（当前连续天数）或longest（最长连续天数）
+    :param limit: 返回的人数
+    :param as_of_day: 基准日期（整数天数），默认所有时区中最早的今天；当前连续天数只统计前一天以后仍有签到的用户
+    :return: LeaderboardEntry列表，按连续天数降序、用户ID升序，已计算并列名次
+    """
+    column = _leaderboard_column(by)
+    if as_of_day is None:
+        as_of_day = date_to_day(earliest_today())
+    live = "AND st.last_sign_date >= ?" if by == 'current' else ""
+    params = (as_of_day - 1, limit) if by == 'current' else (limit,)
+    cursor.execute(f'''
+        SELECT st.user_id, u.username, st.{column}
+        FROM user_stats st
+        JOIN users u ON u.user_id = st.user_id
+        WHERE st.{column} > 0 {live}
+        ORDER BY st.{column} DESC, st.user_id
+        LIMIT ?
+    ''', params)
+    return rank_leaderboard(LeaderboardEntry(None, *row) for row in cursor.fetchall())
+
+
+def rank_leaderboard(entries):
+    """
+    为按连续天数降序排列的排行榜计算名次（天数相同的并列）
+    :param entries: LeaderboardEntry可迭代对象
+    :return: LeaderboardEntry列表
+    """
+    ranked = []
+    for index, entry in enumerate(entries):
+        if ranked and ranked[-1].streak == entry.streak:
+            entry.rank = ranked[-1].rank
+        else:
+            entry.rank = index + 1
+        ranked.append(entry)
+    return ranked
+
+
+def fetch_user_streak(cursor, user_id, by='longest', as_of_day=None):
+    """
+    读取用户参与排名的连续天数（已中断的当前连续天数视为0）
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :param by: 排序依据，current或longest
+    :param as_of_day: 基准日期（整数天数），默认所有时区中最早的今天
+    :return: 连续天数，没有签到记录时返回0
+    """
+    column = _leaderboard_column(by)
+    if as_of_day is None:
+        as_of_day = date_to_day(earliest_today())
+    cursor.execute(
+        f"SELECT {column}, last_sign_date FROM user_stats WHERE user_id = ?", (user_id,)
+    )
+    row = cursor.fetchone()
+    if row is None or (by == 'current' and row[1] < as_of_day - 1):
+        return 0
+    return row[0]
+
+
+def count_users_above(cursor, streak, by='longest'):
+    """
+    从分布表统计连续天数大于streak的用户数（与用户总数无关，亚毫秒级）
+    :param cursor: 数据库游标
+    :param streak: 连续天数
+    :param by: 排序依据，current或longest
+    :return: 用户数
+    """
+    _leaderboard_column(by)
+    cursor.execute(
+        "SELECT COALESCE(SUM(users), 0) FROM streak_histogram WHERE kind = ? AND streak > ?",
+        (by, streak)
+    )
+    return cursor.fetchone()[0]
+
+
+def _leaderboard_column(by):
+    """
+    获取排序依据对应的用户统计表列名
+    """
+    if by not in LEADERBOARD_KINDS:
+        raise ValueError(f"排序依据必须是 {', '.join(LEADERBOARD_KINDS)} 之一")
+    return LEADERBOARD_KINDS[by]
+
+
+def rebuild_user_stats(cursor, user_ids=None):
+    """
+    根据签到记录（含已归档的月度汇总）重新计算用户统计（一次集合运算）
+    :param cursor: 数据库游标
+    :param user_ids: 需要重算的用户ID列表，默认重算全部用户
+    :return: 重算的用户数量
+    """
+    for where, params in _user_id_conditions(user_ids):
+        cursor.execute(f"DELETE FROM user_stats {where}", params)
+        _rebuild_user_stats_where(cursor, where, params)
+
+    # 重算得到的是最后一段连续签到的长度，已中断的需要清零
+    expire_stale_streaks(cursor, date_to_day(earliest_today()))
+    cursor.execute("SELECT COUNT(*) FROM user_stats")
+    return cursor.fetchone()[0]
+
+
+def recompute_missed(cursor, user_ids=None):
+    """
+    重算签到记录的连续未签到天数（每批用户一条窗口函数UPDATE，不逐行计算）
+    :param cursor: 数据库游标
+    :param user_ids: 需要重算的用户ID列表，默认重算全部用户
+    :return: 被修改的签到记录数
+    """
+    changed = 0
+    for where, params in _user_id_conditions(user_ids):
+        _recompute_missed_where(cursor, where, params)
+        changed += cursor.rowcount
+    return changed
+
+
+def _user_id_conditions(user_ids, batch_size=500):
+    """
+    把用户ID列表拆分为若干 WHERE user_id IN (...) 条件，避免超出SQLite的参数数量上限
+    :param user_ids: 用户ID列表，None表示全部用户
+    :param batch_size: 每个条件包含的用户数
+    :return: (WHERE子句, 参数) 生成器，user_ids为None时生成一个空条件
+    """
+    if user_ids is None:
+        yield "", ()
+        return
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), batch_size):
+        batch = tuple(user_ids[start:start + batch_size])
+        placeholders = ", ".join("?" * len(batch))
+        yield f"WHERE user_id IN ({placeholders})", batch
+
+
+def _rebuild_user_stats_where(cursor, where, params):
+    """
+    对满足条件的签到记录按连续日期分组（gaps-and-islands），写入用户统计
+    :param cursor: 数据库游标
+    :param where: 限定签到记录范围的WHERE子句
+    :param params: WHERE子句参数
+    """
+    # 连续日期的 天数 - 行号 相同，据此把签到记录划分为若干连续段
+    cursor.execute(f'''
+        WITH days AS (
+            SELECT user_id, sign_date
+            FROM all_sign_days {where}
+            GROUP BY user_id, sign_date
+        ), islands AS (
+            SELECT user_id, sign_date,
+                   sign_date - ROW_NUMBER() OVER (
+                       PARTITION BY user_id ORDER BY sign_date
+                   ) AS grp
+            FROM days
+        ), runs AS (
+            SELECT user_id, COUNT(*) AS run_length, MAX(sign_date) AS run_end
+            FROM islands
+            GROUP BY user_id, grp
+        ), totals AS (
+            SELECT user_id, MAX(run_length) AS longest_streak,
+                   SUM(run_length) AS total_signs, MAX(run_end) AS last_sign_date
+            FROM runs
+            GROUP BY user_id
+        )
+        INSERT INTO user_stats (user_id, current_streak, longest_streak, last_sign_date, total_signs, updated_at)
+        SELECT t.user_id, r.run_length, t.longest_streak, t.last_sign_date, t.total_signs, {_NOW_SECONDS}
+        FROM totals t
+        JOIN runs r ON r.user_id = t.user_id AND r.run_end = t.last_sign_date
+    ''', params)
+
+
+def _recompute_missed_where(cursor, where, params):
+    """
+    用窗口函数LAG一次性重算签到记录的连续未签到天数
+    :param cursor: 数据库游标
+    :param where: 限定签到记录范围的WHERE子句
+    :param params: WHERE子句参数
+    """
+    # 连续未签到天数 = 与上一次签到（可能已归档）相隔的天数 - 1，首条记录为0
+    cursor.execute(f'''
+        UPDATE sign_records
+        SET consecutive_missed = gaps.missed
+        FROM (
+            SELECT record_id,
+                   COALESCE(sign_date - LAG(sign_date) OVER (
+                       PARTITION BY user_id ORDER BY sign_date
+                   ) - 1, 0) AS missed
+            FROM all_sign_days {where}
+        ) AS gaps
+        WHERE sign_records.record_id = gaps.record_id
+          AND sign_records.consecutive_missed IS NOT gaps.missed
+    ''', params)
+
+
+def update_user_stats(cursor, user_id, sign_date):
+    """
+    新增一条签到记录后增量更新用户统计，需与插入签到记录处于同一事务
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :param sign_date: 新增的签到日期（datetime.date或整数天数）
+    """
+    sign_day = date_to_day(sign_date)
+    cursor.execute(
+        "SELECT current_streak, longest_streak, last_sign_date, total_signs FROM user_stats WHERE user_id = ?",
+        (user_id,)
+    )
+    stats = cursor.fetchone()
+
+    if stats is None:
+        current_streak, longest_streak, total_signs = 1, 1, 1
+    else:
+        current_streak, longest_streak, last_day, total_signs = stats
+        if last_day is not None and sign_day <= last_day:
+            # 补签历史日期会改变已有的连续段，整体重算该用户
+            rebuild_user_stats(cursor, [user_id])
+            return
+        if last_day is not None and sign_day - last_day == 1:
+            current_streak += 1
+        else:
+            current_streak = 1
+        longest_streak = max(longest_streak, current_streak)
+        total_signs += 1
+
+    # 使用UPSERT而不是INSERT OR REPLACE：REPLACE删除旧行时不会触发DELETE触发器，
+    # 排行榜分布表会因此重复计数
+    cursor.execute(f'''
+        INSERT INTO user_stats (user_id, current_streak, longest_streak, last_sign_date, total_signs, updated_at)
+        VALUES (?, ?, ?, ?, ?, {_NOW_SECONDS})
+        ON CONFLICT (user_id) DO UPDATE SET
+            current_streak = excluded.current_streak,
+            longest_streak = excluded.longest_streak,
+            last_sign_date = excluded.last_sign_date,
+            total_signs = excluded.total_signs,
+            updated_at = excluded.updated_at
+    ''', (user_id, current_streak, longest_streak, sign_day, total_signs))
+
+
+def update_sign_bitmap(cursor, user_id, sign_date):
+    """
+    在签到位图中标记一天，需与插入签到记录处于同一事务
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :param sign_date: 签到日期（datetime.date或整数天数）
+    """
+    if isinstance(sign_date, int):
+        sign_date = day_to_date(sign_date)
+    cursor.execute(
+        "SELECT bits FROM sign_bitmaps WHERE user_id = ? AND year = ?",
+        (user_id, sign_date.year)
+    )
+    row = cursor.fetchone()
+    bits = sign_bitmap.to_int(row[0] if row else None) | (1 << sign_bitmap.day_index(sign_date))
+    cursor.execute(
+        "INSERT OR REPLACE INTO sign_bitmaps (user_id, year, bits) VALUES (?, ?, ?)",
+        (user_id, sign_date.year, sign_bitmap.to_blob(bits))
+    )
+
+
+def rebuild_sign_bitmaps(cursor, where="", params=()):
+    """
+    根据签到记录重建签到位图
+    :param cursor: 数据库游标
+    :param where: 限定用户范围的WHERE子句（作用于user_id），默认重建全部用户
+    :param params: WHERE子句参数
+    """
+    cursor.execute(f"DELETE FROM sign_bitmaps {where}", params)
+    rows = cursor.connection.execute(
+        f"SELECT DISTINCT user_id, sign_date FROM all_sign_days {where} ORDER BY user_id, sign_date",
+        params
+    )
+
+    def year_rows():
+        key, bits = None, 0
+        for user_id, day in rows:
+            sign_date = day_to_date(day)
+            if key != (user_id, sign_date.year):
+                if key is not None:
+                    yield key[0], key[1], sign_bitmap.to_blob(bits)
+                key, bits = (user_id, sign_date.year), 0
+            bits |= 1 << sign_bitmap.day_index(sign_date)
+        if key is not None:
+            yield key[0], key[1], sign_bitmap.to_blob(bits)
+
+    cursor.executemany(
+        "INSERT INTO sign_bitmaps (user_id, year, bits) VALUES (?, ?, ?)",
+        year_rows()
+    )
+
+
+def fetch_year_bitmaps(cursor, user_id, years=None):
+    """
+    读取用户的签到位图
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :param years: 需要读取的年份列表（可选），默认读取全部年份
+    :return: {年份: 整数位图}
+    """
+    if years is None:
+        cursor.execute("SELECT year, bits FROM sign_bitmaps WHERE user_id = ?", (user_id,))
+    else:
+        years = tuple(years)
+        placeholders = ", ".join("?" * len(years))
+        cursor.execute(
+            f"SELECT year, bits FROM sign_bitmaps WHERE user_id = ? AND year IN ({placeholders})",
+            (user_id,) + years
+        )
+    return {year: sign_bitmap.to_int(bits) for year, bits in cursor.fetchall()}
+
+
+def sync_sign_in(cursor, user_id, sign_date):
+    """
+    插入一条签到记录后，同步维护用户统计和签到位图
+    需与插入签到记录处于同一事务
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :param sign_date: 签到日期（datetime.date或整数天数）
+    """
+    update_user_stats(cursor, user_id, sign_date)
+    update_sign_bitmap(cursor, user_id, sign_date)
+
+
+def record_sign_in(cursor, user_id, sign_day=None):
+    """
+    写入一条签到记录并同步维护用户统计和签到位图，需在写事务中调用
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :param sign_day: 签到日期（整数天数），默认为用户所在时区的今天
+    :return: 签到记录ID，如果当天已签到返回None
+    """
+    if sign_day is None:
+        sign_day = date_to_day(fetch_user_today(cursor, user_id))
+
+    # 最近签到日期取自用户统计表（签到记录可能已被归档），
+    # 同时用于判断当天是否已签到和计算连续未签到天数
+    cursor.execute(
+        "SELECT last_sign_date FROM user_stats WHERE user_id = ?",
+        (user_id,)
+    )
+    last_record = cursor.fetchone()
+    last_day = last_record[0] if last_record else None
+
+    if last_day is not None and last_day >= sign_day:
+        return None  # 当天已签到
+
+    # 连续未签到天数 = 与上次签到相隔的天数 - 1
+    consecutive_missed = sign_day - last_day - 1 if last_day is not None else 0
+
+    cursor.execute(
+        "INSERT INTO sign_records (user_id, sign_date, consecutive_missed) VALUES (?, ?, ?)",
+        (user_id, sign_day, consecutive_missed)
+    )
+    record_id = cursor.lastrowid
+
+    # 与签到记录在同一事务中更新用户统计和签到位图
+    sync_sign_in(cursor, user_id, sign_day)
+    return record_id
+
+
+def fetch_user_stats(cursor, user_id):
+    """
+    读取用户统计
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :return: 统计信息字典（last_sign_date为datetime.date），如果用户没有签到记录返回None
+    """
+    cursor.execute(
+        "SELECT current_streak, longest_streak, last_sign_date, total_signs FROM user_stats WHERE user_id = ?",
+        (user_id,)
+    )
+    stats = cursor.fetchone()
+    if stats:
+        return {
+            'current_streak': stats[0],
+            'longest_streak': stats[1],
+            'last_sign_date': day_to_date(stats[2]),
+            'total_signs': stats[3]
+        }
+    return None
+
+
+def fetch_dashboard_stats(cursor, user_id):
+    """
+    一次查询读取用户时区和用户统计（主页只需要一次往返）
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :return: (用户所在时区的今天（datetime.date）, 统计信息字典或None（没有签到记录）)，用户不存在时返回None
+    """
+    cursor.execute('''
+        SELECT u.timezone, st.current_streak, st.longest_streak, st.last_sign_date, st.total_signs
+        FROM users u
+        LEFT JOIN user_stats st ON st.user_id = u.user_id
+        WHERE u.user_id = ?
+    ''', (user_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    stats = None
+    if row[3] is not None:
+        stats = {
+            'current_streak': row[1],
+            'longest_streak': row[2],
+            'last_sign_date': day_to_date(row[3]),
+            'total_signs': row[4]
+        }
+    return local_today(row[0]), stats
+
+
+def fetch_stats_version(cursor, user_id):
+    """
+    读取用户统计的版本号（用于HTTP条件请求，只读取用户时区和统计变化时间）
+    :param cursor: 数据库游标
+    :param user_id: 用户ID
+    :return: (时区, 统计最近变化时间（Unix秒，没有签到记录时为None）)，用户不存在时返回None
+    """
+    cursor.execute('''
+        SELECT u.timezone, st.updated_at
+        FROM users u
+        LEFT JOIN user_stats st ON st.user_id = u.user_id
+        WHERE u.user_id = ?
+    ''', (user_id,))
+    return cursor.fetchone()
+
+
+# 读取签到记录（含归档数据）：归档日期没有记录，连续未签到天数按与上一次签到的间隔推算
+ARCHIVED_RECORDS_SQL = """
+    SELECT user_id, sign_date,
+           COALESCE(consecutive_missed, sign_date - LAG(sign_date) OVER (
+               PARTITION BY user_id ORDER BY sign_date
+           ) - 1, 0)
+    FROM all_sign_days {where}
+"""
+
+
+def user_row(cursor, row):
+    """
+    row_factory：把users表的一行转换为User
+    """
+    return User(row[0], row[1], row[2], row[3], row[4], row[5])
+
+
+def sign_record_row(cursor, row):
+    """
+    row_factory：把 (user_id, sign_date, consecutive_missed) 转换为SignRecord
+    """
+    return SignRecord(row[0], day_to_date(row[1]), row[2])
+
+
+def user_status_row(cursor, row):
+    """
+    row_factory：把用户最近签到状态转换为UserStatus
+    """
+    return UserStatus(row[0], row[1], row[2], row[3], day_to_date(row[4]),
+                      row[5] if row[5] is not None else 0)
+
 
 class SignInDatabase:
-    def __init__(self, db_path='sign_in.db'):
+    def __init__(self, db_path='sign_in.db', timeout=30.0, shards=1, backend=None,
+                 cache_size=1024, cache_ttl=300.0, instrument=None):
         """
         初始化数据库连接
         :param db_path: 数据库文件路径，默认当前目录下的sign_in.db
+        :param timeout: 等待写锁的超时时间（秒），默认30秒
+        :param shards: 分片数量，大于1时按用户把数据分散到多个SQLite文件，默认1
+        :param backend: 自定义存储后端（可选），指定后忽略db_path和shards
+        :param cache_size: 用户信息缓存的条目数，默认1024，0表示不缓存
+        :param cache_ttl: 用户信息缓存的有效期（秒），默认300秒
+        :param instrument: 性能统计，True开启，"explain"同时记录执行计划；
+                           默认读取环境变量SIGNIN_INSTRUMENT，未设置时不开启
         """
         self.db_path = db_path
-        self.conn = None
-        self.cursor = None
-        self._connect()
+        self.backend = None
+        # 用户信息缓存，键为 ('id', 用户ID) 或 ('name', 用户名)
+        self.user_cache = LRUCache(cache_size, cache_ttl) if cache_size else None
+        # 最近一次清理过期连续天数的日期（整数天数）
+        self._streaks_expired_on = None
+        self.instrumentation = None
+        self._connect(timeout, shards, backend)
         self._create_tables()
+        
+        if instrument is None:
+            instrument = os.environ.get('SIGNIN_INSTRUMENT')
+        if instrument and instrument != '0':
+            self.enable_instrumentation(explain=(instrument == 'explain'))
     
-    def _connect(self):
+    @property
+    def conn(self):
+        """
+        当前线程的数据库连接（分片存储时为第一个分片的连接）
         """
-        连接到SQLite数据库
+        return self.backend.pools()[0].connection()
+    
+    def _connect(self, timeout, shards, backend):
+        """
+        创建存储后端并连接到SQLite数据库
+        :param timeout: 等待写锁的超时时间（秒）
+        :param shards: 分片数量
+        :param backend: 自定义存储后端，可以为None
         """
         try:
-            self.conn = sqlite3.connect(self.db_path)
-            self.cursor = self.conn.cursor()
-            print(f"数据库连接成功: {self.db_path}")
+            if backend is not None:
+                self.backend = backend
+            elif shards > 1:
+                self.backend = ShardedSQLiteBackend.from_path(self.db_path, shards, timeout)
+            else:
+                self.backend = SQLiteBackend(self.db_path, timeout)
+            for pool in self.backend.pools():
+                pool.connection()
+                print(f"数据库连接成功: {pool.db_path}")
         except sqlite3.Error as e:
             print(f"数据库连接失败: {e}")
             raise
     
+    def _pool(self, user_id):
+        """
+        获取用户所在分片的连接池
+        :param user_id: 用户ID
+        :return: ConnectionPool
+        """
+        return self.backend.pool_for_user(user_id)
+    
     def _create_tables(self):
         """
-        创建用户表和签到记录表
+        创建用户表和签到记录表（每个分片各建一套）
         """
         try:
-            # 用户表：存储用户名、邮箱、电话、注册时间
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL UNIQUE,
-                    email TEXT UNIQUE,
-                    phone TEXT UNIQUE,
-                    register_time DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            for pool in self.backend.pools():
+                with pool.transaction() as cursor:
+                    # 用户表：存储用户名、邮箱、电话、注册时间、时区
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS users (
+                            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            username TEXT NOT NULL UNIQUE,
+                            email TEXT UNIQUE,
+                            phone TEXT UNIQUE,
+                            register_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                            timezone TEXT
+                        )
+                    ''')
+                    
+                    # 签到记录表：存储用户ID、签到日期（整数天数）、未签到累计天数
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS sign_records (
+                            record_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            user_id INTEGER NOT NULL,
+                            sign_date INTEGER NOT NULL,
+                            consecutive_missed INTEGER DEFAULT 0,
+                            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+                            UNIQUE (user_id, sign_date)
+                        )
+                    ''')
+                    
+                    upgrade_schema(cursor)
             
-            # 签到记录表：存储用户ID、签到日期、未签到累计天数
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sign_records (
-                    record_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    sign_date DATE NOT NULL,
-                    consecutive_missed INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    UNIQUE (user_id, sign_date)
-                )
-            ''')
-            
-            self.conn.commit()
             print("数据库表创建成功")
         except sqlite3.Error as e:
             print(f"创建表失败: {e}")
-            self.conn.rollback()
             raise
     
-    def add_user(self, username, email=None, phone=None):
+    def add_user(self, username, email=None, phone=None, timezone=None):
         """
         添加新用户
         :param username: 用户名
         :param email: 邮箱（可选）
         :param phone: 电话（可选）
+        :param timezone: IANA时区名（可选，如Asia/Shanghai），默认服务器本地时区
         :return: 用户ID，如果用户已存在返回None
         """
         if not username:
@@ -75,39 +1259,72 @@ class SignInDatabase:
         if not email and not phone:
             raise ValueError("邮箱和电话不能同时为空")
         
+        timezone = validate_timezone(timezone)
+        
         try:
-            self.cursor.execute(
-                "INSERT INTO users (username, email, phone) VALUES (?, ?, ?)",
-                (username, email, phone)
-            )
-            self.conn.commit()
-            return self.cursor.lastrowid
+            with self.backend.identity_lock():
+                if self._identity_taken(username, email, phone):
+                    return None
+                with self.backend.pool_for_username(username).transaction() as cursor:
+                    user_id = self.backend.allocate_user_id(cursor, username)
+                    cursor.execute(
+                        "INSERT INTO users (user_id, username, email, phone, timezone) VALUES (?, ?, ?, ?, ?)",
+                        (user_id, username, email, phone, timezone)
+                    )
+                    user_id = cursor.lastrowid
+            self._invalidate_users(user_id, username)
+            return user_id
         except sqlite3.IntegrityError:
             # 用户名、邮箱或电话已存在
             return None
         except sqlite3.Error as e:
             print(f"添加用户失败: {e}")
-            self.conn.rollback()
             raise
     
+    def _identity_taken(self, username=None, email=None, phone=None, exclude_user_id=None):
+        """
+        检查用户名、邮箱或电话是否已被其他分片中的用户使用（需在identity_lock()中调用）
+        单个分片时由表的唯一约束保证，直接返回False
+        :param exclude_user_id: 不参与比较的用户ID（修改用户信息时为该用户自己）
+        :return: 是否已被使用
+        """
+        if len(self.backend.pools()) < 2:
+            return False
+        conditions = []
+        params = []
+        for column, value in (("username", username), ("email", email), ("phone", phone)):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if not conditions:
+            return False
+        sql = f"SELECT 1 FROM users WHERE ({' OR '.join(conditions)}) AND user_id IS NOT ? LIMIT 1"
+        
+        def find(pool):
+            with pool.cursor() as cursor:
+                cursor.execute(sql, (*params, exclude_user_id))
+                return cursor.fetchone() is not None
+        
+        return any(self.backend.map_shards(find))
+    
     def get_user_by_id(self, user_id):
         """
         根据用户ID获取用户信息
         :param user_id: 用户ID
-        :return: 用户信息字典，如果不存在返回None
+        :return: 用户信息（User），如果不存在返回None
         """
+        key = ('id', user_id)
+        user = self._cached_user(key)
+        if user is not None:
+            return user
+        generation = self.user_cache.generation() if self.user_cache is not None else None
         try:
-            self.cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            user = self.cursor.fetchone()
-            if user:
-                return {
-                    'user_id': user[0],
-                    'username': user[1],
-                    'email': user[2],
-                    'phone': user[3],
-                    'register_time': user[4]
-                }
-            return None
+            with self._pool(user_id).cursor() as cursor:
+                cursor.row_factory = user_row
+                cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+                user = cursor.fetchone()
+            self._cache_user(key, user, generation)
+            return user
         except sqlite3.Error as e:
             print(f"获取用户信息失败: {e}")
             raise
@@ -116,36 +1333,45 @@ class SignInDatabase:
         """
         根据用户名获取用户信息
         :param username: 用户名
-        :return: 用户信息字典，如果不存在返回None
+        :return: 用户信息（User），如果不存在返回None
         """
+        def find(pool):
+            with pool.cursor() as cursor:
+                cursor.row_factory = user_row
+                cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+                return cursor.fetchone()
+        
+        key = ('name', username)
+        user = self._cached_user(key)
+        if user is not None:
+            return user
+        generation = self.user_cache.generation() if self.user_cache is not None else None
         try:
-            self.cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-            user = self.cursor.fetchone()
-            if user:
-                return {
-                    'user_id': user[0],
-                    'username': user[1],
-                    'email': user[2],
-                    'phone': user[3],
-                    'register_time': user[4]
-                }
-            return None
+            # 先查按用户名哈希得到的分片；改过用户名的用户需要在所有分片中查找
+            user = find(self.backend.pool_for_username(username))
+            if user is None and len(self.backend.pools()) > 1:
+                user = next((found for found in self.backend.map_shards(find) if found), None)
+            self._cache_user(key, user, generation)
+            return user
         except sqlite3.Error as e:
             print(f"获取用户信息失败: {e}")
             raise
     
-    def update_user(self, user_id, username=None, email=None, phone=None):
+    def update_user(self, user_id, username=None, email=None, phone=None, timezone=None):
         """
         更新用户信息
         :param user_id: 用户ID
         :param username: 新用户名（可选）
         :param email: 新邮箱（可选）
         :param phone: 新电话（可选）
+        :param timezone: 新的IANA时区名（可选）
         :return: 是否更新成功
         """
-        if not username and not email and not phone:
+        if not username and not email and not phone and not timezone:
             return False
         
+        timezone = validate_timezone(timezone)
+        
         try:
             # 构建更新语句
             update_fields = []
@@ -160,19 +1386,29 @@ class SignInDatabase:
             if phone:
                 update_fields.append("phone = ?")
                 update_values.append(phone)
+            if timezone:
+                update_fields.append("timezone = ?")
+                update_values.append(timezone)
             
             update_values.append(user_id)
             
-            self.cursor.execute(
-                f"UPDATE users SET {', '.join(update_fields)} WHERE user_id = ?",
-                tuple(update_values)
-            )
-            
-            self.conn.commit()
-            return self.cursor.rowcount > 0
+            with self.backend.identity_lock():
+                if self._identity_taken(username, email, phone, exclude_user_id=user_id):
+                    return False
+                with self._pool(user_id).transaction() as cursor:
+                    # 记下原用户名，用于让按用户名缓存的条目失效
+                    cursor.execute("SELECT username FROM users WHERE user_id = ?", (user_id,))
+                    row = cursor.fetchone()
+                    cursor.execute(
+                        f"UPDATE users SET {', '.join(update_fields)} WHERE user_id = ?",
+                        tuple(update_values)
+                    )
+                    updated = cursor.rowcount > 0
+            if row:
+                self._invalidate_users(user_id, row[0], username)
+            return updated
         except sqlite3.Error as e:
             print(f"更新用户信息失败: {e}")
-            self.conn.rollback()
             raise
     
     def delete_user(self, user_id):
@@ -182,93 +1418,308 @@ class SignInDatabase:
         :return: 是否删除成功
         """
         try:
-            # 先删除该用户的签到记录
-            self.cursor.execute("DELETE FROM sign_records WHERE user_id = ?", (user_id,))
-            # 再删除用户
-            self.cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-            
-            self.conn.commit()
-            return self.cursor.rowcount > 0
+            with self._pool(user_id).transaction() as cursor:
+                cursor.execute("SELECT username FROM users WHERE user_id = ?", (user_id,))
+                row = cursor.fetchone()
+                # 签到记录、归档汇总、统计和位图通过外键级联删除
+                cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+                deleted = cursor.rowcount > 0
+            if row:
+                self._invalidate_users(user_id, row[0])
+            return deleted
         except sqlite3.Error as e:
             print(f"删除用户失败: {e}")
-            self.conn.rollback()
             raise
     
+    def purge_users(self, users, params=(), chunk_size=500, progress=None, pause=0.05):
+        """
+        批量删除用户及其全部签到数据（外键级联删除）
+        每批在一个短事务中删除chunk_size个用户，批次之间释放写锁，不会长时间阻塞签到
+        :param users: 用户ID的可迭代对象，或作用于users表的WHERE条件（如 "user_id NOT IN (SELECT user_id FROM user_stats)"）
+        :param params: WHERE条件的参数
+        :param chunk_size: 每批删除的用户数，默认500
+        :param progress: 进度回调（可选），每批完成后调用 progress(已删除数, 待删除总数)
+        :param pause: 批次之间暂停的秒数，让等待写锁的签到先执行，默认0.05秒
+        :return: 删除的用户数
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size必须大于0")
+        
+        pools = self.backend.pools()
+        if isinstance(users, str):
+            where = users
+            shard_ids = None
+        else:
+            where = None
+            shard_ids = [[] for _ in pools]
+            for user_id in dict.fromkeys(users):
+                shard_ids[self.backend.shard_of(user_id)].append(user_id)
+        
+        try:
+            if shard_ids is None:
+                def count(pool):
+                    with pool.cursor() as cursor:
+                        cursor.execute(f"SELECT COUNT(*) FROM users WHERE {where}", params)
+                        return cursor.fetchone()[0]
+                total = sum(self.backend.map_shards(count))
+            else:
+                total = sum(len(ids) for ids in shard_ids)
+            
+            deleted = 0
+            for shard, pool in enumerate(pools):
+                ids = None if shard_ids is None else shard_ids[shard]
+                offset = 0
+                while True:
+                    if ids is not None:
+                        batch = ids[offset:offset + chunk_size]
+                        offset += chunk_size
+                        if not batch:
+                            break
+                    with pool.transaction() as cursor:
+                        if ids is None:
+                            # 已删除的用户不再满足条件，每次取剩余的前chunk_size个
+                            cursor.execute(
+                                f"SELECT user_id, username FROM users WHERE {where} ORDER BY user_id LIMIT ?",
+                                tuple(params) + (chunk_size,)
+                            )
+                        else:
+                            placeholders = ", ".join("?" * len(batch))
+                            cursor.execute(
+                                f"SELECT user_id, username FROM users WHERE user_id IN ({placeholders})", batch
+                            )
+                        rows = cursor.fetchall()
+                        cursor.executemany("DELETE FROM users WHERE user_id = ?", ((row[0],) for row in rows))
+                    if ids is None and not rows:
+                        break
+                    
+                    for user_id, username in rows:
+                        self._invalidate_users(user_id, username)
+                    deleted += len(rows)
+                    if progress:
+                        progress(deleted, total)
+                    # 释放写锁后稍作等待，让其他连接的写操作先执行
+                    time.sleep(pause)
+            return deleted
+        except sqlite3.Error as e:
+            print(f"批量删除用户失败: {e}")
+            raise
+    
+    def _cached_user(self, key):
+        """
+        从用户信息缓存中读取
+        :param key: 缓存键
+        :return: User，未命中或未启用缓存时返回None
+        """
+        return self.user_cache.get(key) if self.user_cache is not None else None
+    
+    def _cache_user(self, key, user, generation):
+        """
+        把查询到的用户写入缓存（不存在的用户不缓存）
+        :param key: 缓存键
+        :param user: User，可以为None
+        :param generation: 查询前的缓存失效代数
+        """
+        if self.user_cache is not None and user is not None:
+            self.user_cache.put(key, user, generation)
+    
+    def _invalidate_users(self, user_id, *usernames):
+        """
+        用户信息变更提交后，让对应的缓存条目失效
+        :param user_id: 用户ID
+        :param usernames: 变更前后的用户名
+        """
+        if self.user_cache is not None:
+            self.user_cache.invalidate(('id', user_id), *(('name', name) for name in usernames if name))
+    
+    def cache_stats(self):
+        """
+        获取用户信息缓存的命中统计
+        :return: 包含hits、misses、size、maxsize的字典，未启用缓存时返回None
+        """
+        return self.user_cache.stats() if self.user_cache is not None else None
+    
     def get_all_users(self):
         """
-        获取所有用户信息
-        :return: 用户信息列表
+        获取所有用户信息（各分片并行查询）
+        :return: 用户信息（User）列表，按用户ID升序
+        """
+        return self._gather_rows(
+            "获取所有用户失败", user_row,
+            "SELECT * FROM users ORDER BY user_id",
+            key=lambda user: user.user_id
+        )
+    
+    def iter_all_users(self, batch_size=1000):
+        """
+        逐批读取所有用户信息，内存占用与用户总数无关
+        :param batch_size: 每次fetchmany读取的行数，默认1000
+        :return: User生成器，按用户ID升序
+        """
+        yield from self._merge_rows(
+            "获取所有用户失败", user_row, batch_size,
+            "SELECT * FROM users ORDER BY user_id",
+            key=lambda user: user.user_id
+        )
+    
+    def _iter_rows(self, pool, error_message, row_factory, batch_size, sql, params=()):
+        """
+        用短生命周期游标执行查询，并按批次fetchmany返回记录
+        :param pool: 执行查询的连接池
+        :param error_message: 查询失败时打印的提示
+        :param row_factory: 把每行转换为记录对象的函数
+        :param batch_size: 每次fetchmany读取的行数
+        :param sql: 查询语句
+        :param params: 查询参数
+        :return: 记录生成器
         """
         try:
-            self.cursor.execute("SELECT * FROM users")
-            users = self.cursor.fetchall()
-            return [{
-                'user_id': user[0],
-                'username': user[1],
-                'email': user[2],
-                'phone': user[3],
-                'register_time': user[4]
-            } for user in users]
+            with pool.cursor() as cursor:
+                cursor.row_factory = row_factory
+                cursor.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
         except sqlite3.Error as e:
-            print(f"获取所有用户失败: {e}")
+            print(f"{error_message}: {e}")
             raise
     
+    def _merge_rows(self, error_message, row_factory, batch_size, sql, params=(), key=None):
+        """
+        在所有分片上执行同一查询，流式返回记录
+        :param key: 排序键（可选），指定时按该键归并各分片的有序结果，否则依次返回
+        :return: 记录生成器
+        """
+        streams = [
+            self._iter_rows(pool, error_message, row_factory, batch_size, sql, params)
+            for pool in self.backend.pools()
+        ]
+        if len(streams) == 1:
+            return streams[0]
+        if key is None:
+            return itertools.chain.from_iterable(streams)
+        return heapq.merge(*streams, key=key)
+    
+    def _gather_rows(self, error_message, row_factory, sql, params=(), key=None):
+        """
+        在所有分片上并行执行同一查询，汇总为列表
+        :param key: 排序键（可选），指定时按该键归并各分片的有序结果
+        :return: 记录列表
+        """
+        results = self.backend.map_shards(
+            lambda pool: list(self._iter_rows(pool, error_message, row_factory, 1000, sql, params))
+        )
+        if len(results) == 1:
+            return results[0]
+        if key is None:
+            return list(itertools.chain.from_iterable(results))
+        return list(heapq.merge(*results, key=key))
+    
     def add_sign_record(self, user_id):
         """
-        添加签到记录
+        添加签到记录（签到日期为用户所在时区的今天）
         :param user_id: 用户ID
         :return: 签到记录ID
         """
-        today = datetime.date.today()
         try:
-            # 检查今日是否已签到
-            self.cursor.execute(
-                "SELECT * FROM sign_records WHERE user_id = ? AND sign_date = ?",
-                (user_id, today)
-            )
-            if self.cursor.fetchone():
-                return None  # 今日已签到
-            
-            # 计算连续未签到天数
-            yesterday = today - datetime.timedelta(days=1)
-            self.cursor.execute(
-                "SELECT consecutive_missed FROM sign_records WHERE user_id = ? AND sign_date = ?",
-                (user_id, yesterday)
-            )
-            yesterday_record = self.cursor.fetchone()
-            
-            if yesterday_record:
-                # 如果昨天有记录，重置连续未签到天数
-                consecutive_missed = 0
-            else:
-                # 检查最近的签到记录
-                self.cursor.execute(
-                    "SELECT consecutive_missed, sign_date FROM sign_records WHERE user_id = ? ORDER BY sign_date DESC LIMIT 1",
-                    (user_id,)
-                )
-                last_record = self.cursor.fetchone()
-                
-                if last_record:
-                    last_date = last_record[1]
-                    days_diff = (today - datetime.datetime.strptime(last_date, '%Y-%m-%d').date()).days
-                    if days_diff > 1:
-                        consecutive_missed = days_diff - 1
-                    else:
-                        consecutive_missed = 0
-                else:
-                    consecutive_missed = 0
-            
-            # 添加今日签到记录
-            self.cursor.execute(
-                "INSERT INTO sign_records (user_id, sign_date, consecutive_missed) VALUES (?, ?, ?)",
-                (user_id, today, consecutive_missed)
-            )
-            
-            self.conn.commit()
-            return self.cursor.lastrowid
+            with self._pool(user_id).transaction() as cursor:
+                return record_sign_in(cursor, user_id)
         except sqlite3.Error as e:
             print(f"添加签到记录失败: {e}")
-            self.conn.rollback()
+            raise
+    
+    def add_sign_records_bulk(self, records, chunk_size=10000):
+        """
+        批量导入签到记录（用于迁移历史数据），每个分片的导入在一个事务中完成
+        :param records: (用户ID, 签到日期) 的可迭代对象，日期可以是date、YYYY-MM-DD字符串或整数天数
+        :param chunk_size: 每批executemany的记录数，默认10000条
+        :return: 实际插入的记录数（重复记录、已归档的日期、用户不存在的记录会被跳过）
+        """
+        records = iter(records)
+        pools = self.backend.pools()
+        try:
+            with contextlib.ExitStack() as stack:
+                cursors = [stack.enter_context(pool.transaction()) for pool in pools]
+                inserted = 0
+                total = 0
+                # 临时表记录本次导入涉及的用户，导入结束后只重算这些用户
+                for cursor in cursors:
+                    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_sign_users (user_id INTEGER PRIMARY KEY)")
+                    cursor.execute("DELETE FROM temp.bulk_sign_users")
+                
+                while True:
+                    chunk = [(user_id, date_to_day(sign_date))
+                             for user_id, sign_date in itertools.islice(records, chunk_size)]
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    
+                    shard_chunks = [[] for _ in pools]
+                    for row in chunk:
+                        shard_chunks[self.backend.shard_of(row[0])].append(row)
+                    
+                    for cursor, rows in zip(cursors, shard_chunks):
+                        if not rows:
+                            continue
+                        # 借助 (user_id, sign_date) 唯一索引跳过重复记录，已归档的日期同样跳过；
+                        # 用户不存在（或已被清理）的记录也跳过，不会因外键约束中止整个导入
+                        cursor.executemany('''
+                            INSERT OR IGNORE INTO sign_records (user_id, sign_date)
+                            SELECT ?1, ?2
+                            WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?1)
+                              AND NOT EXISTS (
+                                SELECT 1 FROM sign_month_summaries
+                                WHERE user_id = ?1 AND month_start <= ?2 AND month_start > ?2 - 31
+                                  AND (day_bits >> (?2 - month_start)) & 1
+                            )
+                        ''', rows)
+                        inserted += cursor.rowcount
+                        cursor.executemany(
+                            "INSERT OR IGNORE INTO temp.bulk_sign_users (user_id) VALUES (?)",
+                            {(row[0],) for row in rows}
+                        )
+                
+                # 导入完成后，对涉及的用户一次性重算连续未签到天数和用户统计
+                affected = "WHERE user_id IN (SELECT user_id FROM temp.bulk_sign_users)"
+                for cursor in cursors:
+                    _recompute_missed_where(cursor, affected, ())
+                    cursor.execute(f"DELETE FROM user_stats {affected}")
+                    _rebuild_user_stats_where(cursor, affected, ())
+                    expire_stale_streaks(cursor, date_to_day(earliest_today()))
+                    rebuild_sign_bitmaps(cursor, affected)
+                    cursor.execute("DELETE FROM temp.bulk_sign_users")
+                
+                if total > inserted:
+                    print(f"批量导入签到记录：跳过 {total - inserted} 条（重复、已归档或用户不存在）")
+                return inserted
+        except (sqlite3.Error, ValueError) as e:
+            print(f"批量导入签到记录失败: {e}")
+            raise
+    
+    def user_today(self, user_id):
+        """
+        获取用户所在时区的今天
+        :param user_id: 用户ID
+        :return: datetime.date，用户不存在或未设置时区时按服务器本地时区计算
+        """
+        user = self.get_user_by_id(user_id)
+        return local_today(user.timezone if user else None)
+    
+    def get_timezones(self):
+        """
+        获取用户使用的全部时区（各分片并行查询，按时区索引去重）
+        :return: 时区名列表，None表示服务器本地时区
+        """
+        def distinct(pool):
+            with pool.cursor() as cursor:
+                return fetch_timezones(cursor)
+        
+        try:
+            return sorted(set(itertools.chain.from_iterable(self.backend.map_shards(distinct))),
+                          key=lambda timezone: timezone or "")
+        except sqlite3.Error as e:
+            print(f"获取用户时区失败: {e}")
             raise
     
     def get_sign_status(self, user_id):
@@ -277,13 +1728,14 @@ class SignInDatabase:
         :param user_id: 用户ID
         :return: True表示今日已签到，False表示未签到
         """
-        today = datetime.date.today()
+        today = date_to_day(self.user_today(user_id))
         try:
-            self.cursor.execute(
-                "SELECT * FROM sign_records WHERE user_id = ? AND sign_date = ?",
-                (user_id, today)
-            )
-            return self.cursor.fetchone() is not None
+            with self._pool(user_id).cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM sign_records WHERE user_id = ? AND sign_date = ?",
+                    (user_id, today)
+                )
+                return cursor.fetchone() is not None
         except sqlite3.Error as e:
             print(f"获取签到状态失败: {e}")
             raise
@@ -293,46 +1745,114 @@ class SignInDatabase:
         获取用户签到历史记录
         :param user_id: 用户ID
         :param limit: 返回记录数量限制，默认30条
-        :return: 签到历史记录列表
+        :return: 签到历史记录（SignRecord）列表，按日期倒序
         """
         try:
-            self.cursor.execute(
-                "SELECT sign_date, consecutive_missed FROM sign_records WHERE user_id = ? ORDER BY sign_date DESC LIMIT ?",
-                (user_id, limit)
-            )
-            records = self.cursor.fetchall()
-            return [{
-                'sign_date': record[0],
-                'consecutive_missed': record[1]
-            } for record in records]
+            with self._pool(user_id).cursor() as cursor:
+                cursor.row_factory = sign_record_row
+                cursor.execute(
+                    "SELECT user_id, sign_date, consecutive_missed FROM sign_records WHERE user_id = ? ORDER BY sign_date DESC LIMIT ?",
+                    (user_id, limit)
+                )
+                history = cursor.fetchall()
+                if len(history) < limit:
+                    # 热数据不足时从归档汇总补齐，连续未签到天数按相邻签到日期推算
+                    cursor.execute(
+                        ARCHIVED_RECORDS_SQL.format(where="WHERE user_id = ?") + " ORDER BY sign_date DESC LIMIT ?",
+                        (user_id, limit)
+                    )
+                    history = cursor.fetchall()
+                return history
         except sqlite3.Error as e:
             print(f"获取签到历史失败: {e}")
             raise
     
+    def iter_sign_records(self, user_id=None, batch_size=1000):
+        """
+        逐批读取签到记录
+        :param user_id: 用户ID（可选），默认读取所有用户
+        :param batch_size: 每次fetchmany读取的行数，默认1000
+        :return: SignRecord生成器（包含已归档的签到日期），按用户ID、签到日期升序
+        """
+        if user_id is None:
+            yield from self._merge_rows(
+                "获取签到记录失败", sign_record_row, batch_size,
+                ARCHIVED_RECORDS_SQL.format(where="") + " ORDER BY user_id, sign_date",
+                key=lambda record: (record.user_id, record.sign_date)
+            )
+        else:
+            yield from self._iter_rows(
+                self._pool(user_id), "获取签到记录失败", sign_record_row, batch_size,
+                ARCHIVED_RECORDS_SQL.format(where="WHERE user_id = ?") + " ORDER BY sign_date",
+                (user_id,)
+            )
+    
     def get_all_sign_records(self):
         """
-        获取所有用户的签到记录（用于定时检测）
-        :return: 签到记录列表，包含用户ID、签到日期、连续未签到天数
+        获取所有用户的签到记录（用于定时检测，各分片并行查询）
+        :return: UserStatus列表，包含用户ID、最后签到日期、连续未签到天数
+        """
+        # 最近签到日期直接取自用户统计表，不再对每个用户执行MAX子查询
+        return self._gather_rows("获取所有签到记录失败", user_status_row, """
+            SELECT u.user_id, u.username, u.email, u.phone, st.last_sign_date, s.consecutive_missed
+            FROM users u
+            LEFT JOIN user_stats st ON st.user_id = u.user_id
+            LEFT JOIN sign_records s ON s.user_id = u.user_id AND s.sign_date = st.last_sign_date
+        """)
+    
+    def get_overdue_users(self, threshold_days=2, as_of=None, timezones=None):
+        """
+        获取连续未签到天数达到阈值的用户（从未签到过的用户不计入，各分片并行查询）
+        :param threshold_days: 连续未签到天数阈值，默认2天
+        :param as_of: 计算基准日期（datetime.date），默认今天
+        :param timezones: 只查询这些时区的用户（可选，None表示服务器本地时区），默认全部用户
+        :return: UserStatus列表，包含用户ID、用户名、邮箱、电话、最后签到日期、连续未签到天数
+        """
+        return self._gather_rows(
+            "获取逾期用户失败", user_status_row, *overdue_users_query(threshold_days, as_of, timezones)
+        )
+    
+    def iter_overdue_users(self, threshold_days=2, as_of=None, batch_size=1000, timezones=None):
+        """
+        逐批读取连续未签到天数达到阈值的用户
+        :param threshold_days: 连续未签到天数阈值，默认2天
+        :param as_of: 计算基准日期（datetime.date），默认今天
+        :param batch_size: 每次fetchmany读取的行数，默认1000
+        :param timezones: 只查询这些时区的用户（可选，None表示服务器本地时区），默认全部用户
+        :return: UserStatus生成器
+        """
+        yield from self._merge_rows(
+            "获取逾期用户失败", user_status_row, batch_size, *overdue_users_query(threshold_days, as_of, timezones)
+        )
+    
+    def claim_reminder(self, user_id, last_sign_date, channel):
+        """
+        领取一次提醒的发送权，发送前调用，保证每次连续未签到每个渠道最多提醒一次
+        :param user_id: 用户ID
+        :param last_sign_date: 最后签到日期（datetime.date）
+        :param channel: 提醒渠道，如email、sms
+        :return: 是否领取成功，成功时应发送提醒并调用finish_reminder记录结果
         """
         try:
-            self.cursor.execute("""
-                SELECT u.user_id, u.username, u.email, u.phone, s.sign_date, s.consecutive_missed
-                FROM users u
-                LEFT JOIN sign_records s ON u.user_id = s.user_id
-                WHERE s.sign_date = (SELECT MAX(sign_date) FROM sign_records WHERE user_id = u.user_id)
-                OR s.sign_date IS NULL
-            """)
-            records = self.cursor.fetchall()
-            return [{
-                'user_id': record[0],
-                'username': record[1],
-                'email': record[2],
-                'phone': record[3],
-                'last_sign_date': record[4],
-                'consecutive_missed': record[5] if record[5] is not None else 0
-            } for record in records]
+            with self._pool(user_id).transaction() as cursor:
+                return claim_reminder(cursor, user_id, date_to_day(last_sign_date) + 1, channel)
         except sqlite3.Error as e:
-            print(f"获取所有签到记录失败: {e}")
+            print(f"领取提醒发送权失败: {e}")
+            raise
+    
+    def finish_reminder(self, user_id, last_sign_date, channel, success):
+        """
+        记录提醒的发送结果
+        :param user_id: 用户ID
+        :param last_sign_date: 最后签到日期（datetime.date）
+        :param channel: 提醒渠道
+        :param success: 是否发送成功
+        """
+        try:
+            with self._pool(user_id).transaction() as cursor:
+                finish_reminder(cursor, user_id, date_to_day(last_sign_date) + 1, channel, success)
+        except sqlite3.Error as e:
+            print(f"记录提醒发送结果失败: {e}")
             raise
     
     def get_consecutive_sign_days(self, user_id):
@@ -341,23 +1861,14 @@ class SignInDatabase:
         :param user_id: 用户ID
         :return: 连续签到天数
         """
-        today = datetime.date.today()
+        today = self.user_today(user_id)
         try:
-            consecutive_days = 0
-            current_date = today
-            
-            while True:
-                self.cursor.execute(
-                    "SELECT * FROM sign_records WHERE user_id = ? AND sign_date = ?",
-                    (user_id, current_date)
-                )
-                if self.cursor.fetchone():
-                    consecutive_days += 1
-                    current_date -= datetime.timedelta(days=1)
-                else:
-                    break
-            
-            return consecutive_days
+            with self._pool(user_id).cursor() as cursor:
+                stats = fetch_user_stats(cursor, user_id)
+            # 今日未签到时连续签到天数为0
+            if stats and stats['last_sign_date'] == today:
+                return stats['current_streak']
+            return 0
         except sqlite3.Error as e:
             print(f"获取连续签到天数失败: {e}")
             raise
@@ -369,43 +1880,228 @@ class SignInDatabase:
         :return: 最长连续签到天数
         """
         try:
-            # 获取所有签到记录，按日期排序
-            self.cursor.execute(
-                "SELECT sign_date FROM sign_records WHERE user_id = ? ORDER BY sign_date ASC",
-                (user_id,)
-            )
-            records = self.cursor.fetchall()
+            with self._pool(user_id).cursor() as cursor:
+                stats = fetch_user_stats(cursor, user_id)
+            return stats['longest_streak'] if stats else 0
+        except sqlite3.Error as e:
+            print(f"获取最长连续签到天数失败: {e}")
+            raise
+    
+    def get_sign_calendar(self, user_id, year, month=None):
+        """
+        获取用户某年（或某月）的签到日历，只读取一行签到位图
+        :param user_id: 用户ID
+        :param year: 年份
+        :param month: 月份（可选），默认整年
+        :return: 已签到日期列表，按日期升序
+        """
+        try:
+            with self._pool(user_id).cursor() as cursor:
+                bits = fetch_year_bitmaps(cursor, user_id, [year]).get(year, 0)
+            return sign_bitmap.signed_days(bits, year, month)
+        except sqlite3.Error as e:
+            print(f"获取签到日历失败: {e}")
+            raise
+    
+    def get_bitmap_streaks(self, user_id, as_of=None):
+        """
+        用签到位图计算连续签到天数和最长连续签到天数（用于校验用户统计表）
+        :param user_id: 用户ID
+        :param as_of: 计算基准日期（datetime.date），默认用户所在时区的今天
+        :return: 包含current_streak和longest_streak的字典
+        """
+        as_of = as_of or self.user_today(user_id)
+        try:
+            with self._pool(user_id).cursor() as cursor:
+                year_bits = fetch_year_bitmaps(cursor, user_id)
+            return {
+                'current_streak': sign_bitmap.current_streak(year_bits, as_of),
+                'longest_streak': sign_bitmap.longest_streak(year_bits)
+            }
+        except sqlite3.Error as e:
+            print(f"计算位图连续签到天数失败: {e}")
+            raise
+    
+    def expire_stale_streaks(self, as_of=None):
+        """
+        把已经中断的当前连续天数清零（每天执行一次即可，排行榜查询前会自动执行）
+        :param as_of: 基准日期（datetime.date），默认所有时区中最早的今天
+        :return: 清零的用户数
+        """
+        as_of_day = date_to_day(as_of or earliest_today())
+        
+        def expire(pool):
+            with pool.transaction() as cursor:
+                return expire_stale_streaks(cursor, as_of_day)
+        
+        try:
+            expired = sum(self.backend.map_shards(expire))
+            self._streaks_expired_on = as_of_day
+            return expired
+        except sqlite3.Error as e:
+            print(f"清理过期连续天数失败: {e}")
+            raise
+    
+    def _ensure_streaks_expired(self, as_of_day):
+        """
+        当天还没有清理过期连续天数时先清理，保证当前连续天数的排名正确
+        """
+        if self._streaks_expired_on != as_of_day:
+            self.expire_stale_streaks(day_to_date(as_of_day))
+    
+    def get_leaderboard(self, by='longest', limit=10):
+        """
+        获取连续签到天数排行榜（各分片并行查询后归并）
+        :param by: 排序依据，current（当前连续天数）或longest（最长连续天数），默认longest
+        :param limit: 返回的人数，默认10
+        :return: LeaderboardEntry列表，包含名次、用户ID、用户名、连续天数
+        """
+        # 按最早的时区判断连续签到是否中断，与过期清理保持一致
+        today = date_to_day(earliest_today())
+        try:
+            if by == 'current':
+                self._ensure_streaks_expired(today)
             
-            if not records:
-                return 0
+            def top(pool):
+                with pool.cursor() as cursor:
+                    return fetch_leaderboard(cursor, by, limit, today)
             
-            longest_streak = 1
-            current_streak = 1
-            previous_date = None
+            results = self.backend.map_shards(top)
+            if len(results) == 1:
+                return results[0]
+            merged = heapq.merge(*results, key=lambda entry: (-entry.streak, entry.user_id))
+            return rank_leaderboard(itertools.islice(merged, limit))
+        except sqlite3.Error as e:
+            print(f"获取排行榜失败: {e}")
+            raise
+    
+    def get_user_rank(self, user_id, by='longest'):
+        """
+        获取用户在排行榜中的名次（只读取分布表，与用户总数无关）
+        :param user_id: 用户ID
+        :param by: 排序依据，current或longest，默认longest
+        :return: 包含rank和streak的字典，连续天数为0时rank为None
+        """
+        today = date_to_day(earliest_today())
+        try:
+            if by == 'current':
+                self._ensure_streaks_expired(today)
+            with self._pool(user_id).cursor() as cursor:
+                streak = fetch_user_streak(cursor, user_id, by, today)
+            if streak == 0:
+                return {'rank': None, 'streak': 0}
             
-            for record in records:
-                sign_date = datetime.datetime.strptime(record[0], '%Y-%m-%d').date()
-                if previous_date:
-                    # 检查是否连续
-                    if (sign_date - previous_date).days == 1:
-                        current_streak += 1
-                        if current_streak > longest_streak:
-                            longest_streak = current_streak
-                    else:
-                        current_streak = 1
-                previous_date = sign_date
+            def above(pool):
+                with pool.cursor() as cursor:
+                    return count_users_above(cursor, streak, by)
             
-            return longest_streak
+            return {'rank': 1 + sum(self.backend.map_shards(above)), 'streak': streak}
         except sqlite3.Error as e:
-            print(f"获取最长连续签到天数失败: {e}")
+            print(f"获取用户排名失败: {e}")
             raise
     
+    def rebuild_user_stats(self, user_ids=None):
+        """
+        根据签到记录回填用户统计表
+        :param user_ids: 需要重算的用户ID列表，默认重算全部用户
+        :return: 用户统计表中的用户数量
+        """
+        pools = self.backend.pools()
+        shard_user_ids = self._split_by_shard(user_ids)
+        
+        def rebuild(pool):
+            with pool.transaction() as cursor:
+                return rebuild_user_stats(cursor, shard_user_ids[pools.index(pool)])
+        
+        try:
+            return sum(self.backend.map_shards(rebuild))
+        except sqlite3.Error as e:
+            print(f"回填用户统计失败: {e}")
+            raise
+    
+    def recompute_missed(self, user_ids=None):
+        """
+        重算签到记录的连续未签到天数（导入、删除或补录签到记录后使用）
+        :param user_ids: 需要重算的用户ID列表，默认重算全部用户
+        :return: 被修改的签到记录数
+        """
+        pools = self.backend.pools()
+        shard_user_ids = self._split_by_shard(user_ids)
+        
+        def recompute(pool):
+            with pool.transaction() as cursor:
+                return recompute_missed(cursor, shard_user_ids[pools.index(pool)])
+        
+        try:
+            return sum(self.backend.map_shards(recompute))
+        except sqlite3.Error as e:
+            print(f"重算连续未签到天数失败: {e}")
+            raise
+    
+    def _split_by_shard(self, user_ids):
+        """
+        按分片拆分用户ID列表
+        :param user_ids: 用户ID列表，None表示全部用户
+        :return: 按分片序号排列的用户ID列表（user_ids为None时每个分片都是None）
+        """
+        pools = self.backend.pools()
+        if user_ids is None:
+            return [None] * len(pools)
+        shard_user_ids = [[] for _ in pools]
+        for user_id in user_ids:
+            shard_user_ids[self.backend.shard_of(user_id)].append(user_id)
+        return shard_user_ids
+    
+    def compact_sign_records(self, horizon_days=ARCHIVE_HORIZON_DAYS, as_of=None):
+        """
+        把保留期之前的签到记录折叠为按月汇总，限制签到记录表和索引的大小
+        历史、统计等查询会透明地合并归档数据
+        :param horizon_days: 保留期（天），默认400天；只归档保留期之前的完整月份
+        :param as_of: 计算基准日期（datetime.date），默认今天
+        :return: (删除的签到记录数, 写入的月度汇总行数)
+        """
+        cutoff = archive_cutoff(horizon_days, as_of)
+        
+        def compact(pool):
+            with pool.transaction() as cursor:
+                return compact_sign_records(cursor, cutoff)
+        
+        try:
+            results = self.backend.map_shards(compact)
+            return sum(r[0] for r in results), sum(r[1] for r in results)
+        except sqlite3.Error as e:
+            print(f"归档签到记录失败: {e}")
+            raise
+    
+    def enable_instrumentation(self, explain=False):
+        """
+        开启性能统计：记录每个公开方法的调用次数、耗时分布和返回行数
+        :param explain: 是否同时记录执行过的SQL语句，用于生成执行计划，默认False
+        :return: Instrumentation
+        """
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation(explain)
+            self.instrumentation.wrap(self, [
+                name for name, member in vars(SignInDatabase).items()
+                if callable(member) and not name.startswith('_') and name not in self._UNINSTRUMENTED
+            ])
+            for pool in self.backend.pools():
+                pool.add_connection_hook(lambda conn, pool=pool: self.instrumentation.attach(conn, pool))
+        return self.instrumentation
+    
+    # 不做统计的方法
+    _UNINSTRUMENTED = ('close', 'enable_instrumentation', 'cache_stats')
+    
     def close(self):
         """
-        关闭数据库连接
+        关闭数据库连接（包括其他线程创建的连接）
+        设置了环境变量SIGNIN_INSTRUMENT_DUMP时，先把性能统计写入该文件
         """
-        if self.conn:
-            self.conn.close()
+        dump_path = os.environ.get('SIGNIN_INSTRUMENT_DUMP')
+        if self.instrumentation is not None and dump_path:
+            self.instrumentation.dump(dump_path)
+        if self.backend:
+            self.backend.close_all()
             print("数据库连接已关闭")
 
 # 测试代码
@@ -0,0 +1,226 @@
+"""
+数据导出
+把用户、签到记录和用户统计流式导出为CSV或NDJSON（可选gzip压缩）。
+按主键分页读取（WHERE user_id > 上一页最后一个ID ... LIMIT N），每页一个短查询，
+不会长时间占用读事务；每页读完立即编码输出，内存占用与数据总量无关。
+
+用法：
+    with open("sign_records.csv.gz", "wb") as f:
+        export_to_file(db.backend, f, "sign_records", fmt="csv", compress=True)
+也可以用 python manage.py export sign_records --format csv --gzip -o sign_records.csv.gz
+"""
+
+import csv
+import datetime
+import heapq
+import io
+import json
+import zlib
+
+from database import ARCHIVED_RECORDS_SQL, date_to_day, day_to_date
+
+EXPORT_DATASETS = ("users", "sign_records", "stats")
+EXPORT_FORMATS = ("csv", "ndjson")
+
+SIGN_RECORD_COLUMNS = ("user_id", "sign_date", "consecutive_missed")
+STATS_COLUMNS = ("user_id", "current_streak", "longest_streak", "last_sign_date", "total_signs")
+
+
+def export_columns(backend, dataset):
+    """
+    获取导出数据的列名
+    :param backend: 存储后端
+    :param dataset: 导出的数据，users/sign_records/stats
+    :return: 列名元组
+    """
+    if dataset == "users":
+        # 用户表的列在不同版本中不同（register_time/created_at），以实际表结构为准
+        with backend.pools()[0].cursor() as cursor:
+            cursor.execute("SELECT * FROM users LIMIT 0")
+            return tuple(column[0] for column in cursor.description)
+    if dataset == "sign_records":
+        return SIGN_RECORD_COLUMNS
+    if dataset == "stats":
+        return STATS_COLUMNS
+    raise ValueError(f"导出数据必须是 {', '.join(EXPORT_DATASETS)} 之一")
+
+
+def iter_export_rows(backend, dataset, chunk_size=1000, as_of=None):
+    """
+    分页读取导出数据，多个分片时按用户ID归并
+    :param backend: 存储后端
+    :param dataset: 导出的数据，users/sign_records/stats
+    :param chunk_size: 每页读取的行数，默认1000
+    :param as_of: 计算当前连续天数的基准日期（datetime.date），默认今天
+    :return: 行元组生成器，按用户ID（签到记录再按日期）升序
+    """
+    if dataset == "users":
+        pages = [_user_pages(pool, chunk_size) for pool in backend.pools()]
+    elif dataset == "sign_records":
+        pages = [_sign_record_pages(pool, chunk_size) for pool in backend.pools()]
+    elif dataset == "stats":
+        today = date_to_day(as_of or datetime.date.today())
+        pages = [_stats_pages(pool, chunk_size, today) for pool in backend.pools()]
+    else:
+        raise ValueError(f"导出数据必须是 {', '.join(EXPORT_DATASETS)} 之一")
+
+    streams = [(row for page in shard_pages for row in page) for shard_pages in pages]
+    if len(streams) == 1:
+        return streams[0]
+    # 各行的前两列是用户ID和（签到记录的）日期，正好作为归并的排序键
+    return heapq.merge(*streams, key=lambda row: row[:2])
+
+
+def _user_pages(pool, chunk_size):
+    """
+    按用户ID分页读取用户表
+    :return: 每页行列表的生成器
+    """
+    last_id = 0
+    while True:
+        with pool.cursor() as cursor:
+            cursor.execute(
+                "SELECT * FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (last_id, chunk_size)
+            )
+            rows = cursor.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def _stats_pages(pool, chunk_size, today):
+    """
+    按用户ID分页读取用户统计
+    :param today: 基准日期（整数天数），最后签到早于昨天的用户当前连续天数按0导出
+    :return: 每页行列表的生成器
+    """
+    last_id = 0
+    while True:
+        with pool.cursor() as cursor:
+            cursor.execute("""
+                SELECT user_id,
+                       CASE WHEN last_sign_date >= ? THEN current_streak ELSE 0 END,
+                       longest_streak, last_sign_date, total_signs
+                FROM user_stats
+                WHERE user_id > ?
+                ORDER BY user_id
+                LIMIT ?
+            """, (today - 1, last_id, chunk_size))
+            rows = cursor.fetchall()
+        if not rows:
+            return
+        yield [(row[0], row[1], row[2], _iso(row[3]), row[4]) for row in rows]
+        last_id = rows[-1][0]
+
+
+def _sign_record_pages(pool, chunk_size):
+    """
+    按用户ID区间分页读取签到记录（含已归档的签到日期）
+    一页总是包含若干用户的全部签到记录，这样归档日期的连续未签到天数（按与上一次签到的间隔推算）
+    不会因为分页而断开；每页的用户按签到总数累加到约chunk_size行为止
+    :return: 每页行列表的生成器
+    """
+    last_id = 0
+    while True:
+        with pool.cursor() as cursor:
+            cursor.execute(
+                "SELECT user_id, total_signs FROM user_stats WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (last_id, chunk_size)
+            )
+            upper_id = None
+            total = 0
+            for user_id, total_signs in cursor:
+                upper_id = user_id
+                total += total_signs
+                if total >= chunk_size:
+                    break
+            if upper_id is None:
+                return
+            cursor.execute(
+                ARCHIVED_RECORDS_SQL.format(where="WHERE user_id > ? AND user_id <= ?")
+                + " ORDER BY user_id, sign_date",
+                (last_id, upper_id)
+            )
+            rows = cursor.fetchall()
+        yield [(row[0], _iso(row[1]), row[2]) for row in rows]
+        last_id = upper_id
+
+
+def _iso(day):
+    """
+    把整数天数转换为YYYY-MM-DD字符串
+    """
+    date = day_to_date(day)
+    return date.isoformat() if date is not None else None
+
+
+def iter_export(backend, dataset, fmt="csv", compress=False, chunk_size=1000, as_of=None):
+    """
+    流式生成导出文件的内容
+    先输出表头（CSV）再逐页查询，调用方拿到第一段数据不需要等待任何查询
+    :param backend: 存储后端
+    :param dataset: 导出的数据，users/sign_records/stats
+    :param fmt: 导出格式，csv或ndjson，默认csv
+    :param compress: 是否gzip压缩，默认False
+    :param chunk_size: 每页读取的行数，默认1000
+    :param as_of: 计算当前连续天数的基准日期（datetime.date），默认今天
+    :return: bytes生成器
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"导出格式必须是 {', '.join(EXPORT_FORMATS)} 之一")
+    columns = export_columns(backend, dataset)
+    rows = iter_export_rows(backend, dataset, chunk_size, as_of)
+
+    # wbits=31 生成gzip格式；每页以Z_SYNC_FLUSH结束，压缩数据可以立即发出
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def emit(text, final=False):
+        data = text.encode("utf-8")
+        if compressor is None:
+            return data
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n") if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(columns)
+        yield emit(buffer.getvalue())
+
+    while True:
+        buffer.seek(0)
+        buffer.truncate()
+        count = 0
+        for row in rows:
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                buffer.write("\n")
+            count += 1
+            if count >= chunk_size:
+                break
+        if count < chunk_size:
+            yield emit(buffer.getvalue(), final=True)
+            return
+        yield emit(buffer.getvalue())
+
+
+def export_to_file(backend, fileobj, dataset, fmt="csv", compress=False, chunk_size=1000, as_of=None):
+    """
+    把导出数据写入文件
+    :param backend: 存储后端
+    :param fileobj: 以二进制模式打开的文件对象
+    :param dataset: 导出的数据，users/sign_records/stats
+    :param fmt: 导出格式，csv或ndjson，默认csv
+    :param compress: 是否gzip压缩，默认False
+    :param chunk_size: 每页读取的行数，默认1000
+    :param as_of: 计算当前连续天数的基准日期（datetime.date），默认今天
+    :return: 写入的字节数
+    """
+    written = 0
+    for data in iter_export(backend, dataset, fmt, compress, chunk_size, as_of):
+        fileobj.write(data)
+        written += len(data)
+    return written
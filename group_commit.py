@@ -0,0 +1,172 @@
+"""
+签到组提交写入器
+早高峰时大量用户集中签到，每次签到单独提交都要等待一次磁盘同步。
+GroupCommitWriter把签到请求放入队列，由单个写线程每隔几毫秒（或攒够N条）
+在一个事务中批量写入，多次签到共用一次提交。
+
+用法：
+    writer = GroupCommitWriter(db.backend)
+    future = writer.submit(user_id)
+    record_id = future.result()   # 签到记录ID，当天已签到时为None
+    writer.close()
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from database import record_sign_in
+
+# 持久性级别，对应写线程连接的 PRAGMA synchronous
+# FULL：每次组提交都同步到磁盘，future完成即表示签到已落盘
+# NORMAL：WAL模式下提交不等待磁盘同步，断电可能丢失最近的签到，但数据库不会损坏
+# OFF：完全不同步，只适合可以重建的数据
+DURABILITY_LEVELS = ("OFF", "NORMAL", "FULL")
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    def __init__(self, backend, max_batch=256, max_delay=0.005, durability="FULL"):
+        """
+        初始化组提交写入器并启动写线程
+        :param backend: 存储后端（如SignInDatabase.backend）
+        :param max_batch: 每次提交最多包含的签到数，默认256
+        :param max_delay: 收到第一条签到后最多等待多久提交（秒），默认5毫秒
+        :param durability: 持久性级别，OFF/NORMAL/FULL，默认FULL
+        """
+        durability = durability.upper()
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"持久性级别必须是 {', '.join(DURABILITY_LEVELS)} 之一")
+        if max_batch < 1:
+            raise ValueError("max_batch必须大于0")
+
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.durability = durability
+        self.batches = 0
+        self.committed = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def submit(self, user_id):
+        """
+        提交一次今日签到
+        :param user_id: 用户ID
+        :return: concurrent.futures.Future，结果为签到记录ID，当天（用户所在时区）已签到时为None
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("写入器已关闭")
+            self._queue.put((user_id, future))
+        return future
+
+    def sign_in(self, user_id, timeout=None):
+        """
+        提交一次今日签到并等待写入完成
+        :param user_id: 用户ID
+        :param timeout: 等待超时时间（秒），默认一直等待
+        :return: 签到记录ID，当天已签到时为None
+        """
+        return self.submit(user_id).result(timeout)
+
+    def close(self):
+        """
+        停止接收新的签到，写完队列中剩余的签到后结束写线程
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        """
+        写线程主循环：取出一批签到，按分片各用一个事务写入
+        """
+        for pool in self.backend.pools():
+            pool.connection().execute(f"PRAGMA synchronous={self.durability}")
+
+        stopping = False
+        while not stopping:
+            batch = []
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch.append(item)
+
+            # 收到第一条后继续收集，直到攒够一批或等待超时
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                self._flush(batch)
+            except Exception as e:
+                # 任何异常都不能让写线程退出，否则之后的签到都会等到超时
+                print(f"组提交签到失败: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _flush(self, batch):
+        """
+        写入一批签到
+        :param batch: (用户ID, Future) 列表
+        """
+        shard_batches = {}
+        for user_id, future in batch:
+            if future.set_running_or_notify_cancel():
+                shard_batches.setdefault(self.backend.shard_of(user_id), []).append((user_id, future))
+
+        pools = self.backend.pools()
+        for shard, items in shard_batches.items():
+            self._commit(pools[shard], items)
+
+    def _commit(self, pool, items):
+        """
+        在一个事务中写入同一分片的一批签到，并设置各自的Future结果
+        签到日期按各用户所在时区的今天计算
+        :param pool: 分片的连接池
+        :param items: (用户ID, Future) 列表
+        """
+        try:
+            with pool.transaction() as cursor:
+                results = [record_sign_in(cursor, user_id) for user_id, _ in items]
+        except Exception as e:
+            # 除数据库错误外，按用户时区计算日期等步骤也可能出错（如时区数据缺失）
+            if len(items) == 1:
+                print(f"添加签到记录失败: {e}")
+                items[0][1].set_exception(e)
+                return
+            # 整批已回滚，改为逐条提交，单条失败不影响同批的其他签到
+            print(f"组提交签到失败，改为逐条写入: {e}")
+            for item in items:
+                self._commit(pool, [item])
+            return
+
+        self.batches += 1
+        self.committed += len(items)
+        for (_, future), record_id in zip(items, results):
+            future.set_result(record_id)
@@ -100,6 +100,8 @@ class SignInApp:
         # self._create_stats_section()  # 取消注释，测试统计功能区
         # 注释掉可能有问题的组件创建方法，先测试基本功能
         # self._create_history_section()
+        # 排行榜面板（可选）
+        # self._create_leaderboard_section()
         
         # 刷新界面数据
         # self._refresh_sign_status()
@@ -700,6 +702,7 @@ class SignInApp:
         # 历史记录框架
         history_frame = ttk.LabelFrame(self.main_frame, text="签到历史", padding="15")
         history_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
+        self.history_frame = history_frame
         
         # 创建表格
         columns = ("date", "status")
@@ -734,6 +737,45 @@ class SignInApp:
         self.history_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y, ipady=10)
     
+    def _create_leaderboard_section(self):
+        """
+        创建连续签到排行榜区（可选面板）
+        """
+        leaderboard_frame = ttk.LabelFrame(self.main_frame, text="连续签到排行榜", padding="15")
+        leaderboard_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
+        self.leaderboard_frame = leaderboard_frame
+        
+        # 切换排序依据：当前连续天数 / 最长连续天数
+        self.leaderboard_by = tk.StringVar(value="current")
+        switch_frame = ttk.Frame(leaderboard_frame)
+        switch_frame.pack(fill=tk.X, pady=(0, 10))
+        ttk.Radiobutton(switch_frame, text="当前连续", value="current",
+                        variable=self.leaderboard_by, command=self._refresh_leaderboard).pack(side=tk.LEFT)
+        ttk.Radiobutton(switch_frame, text="最长连续", value="longest",
+                        variable=self.leaderboard_by, command=self._refresh_leaderboard).pack(side=tk.LEFT, padx=(10, 0))
+        
+        # 当前用户的排名
+        self.my_rank_label = ttk.Label(switch_frame, text="")
+        self.my_rank_label.pack(side=tk.RIGHT)
+        
+        columns = ("rank", "username", "streak")
+        self.leaderboard_tree = ttk.Treeview(
+            leaderboard_frame,
+            columns=columns,
+            show="headings",
+            height=10,
+            selectmode="browse"
+        )
+        self.leaderboard_tree.heading("rank", text="名次", anchor=tk.CENTER)
+        self.leaderboard_tree.heading("username", text="名字", anchor=tk.CENTER)
+        self.leaderboard_tree.heading("streak", text="天数", anchor=tk.CENTER)
+        self.leaderboard_tree.column("rank", width=80, anchor=tk.CENTER, minwidth=60)
+        self.leaderboard_tree.column("username", width=180, anchor=tk.CENTER, minwidth=120)
+        self.leaderboard_tree.column("streak", width=100, anchor=tk.CENTER, minwidth=80)
+        self.leaderboard_tree.pack(fill=tk.BOTH, expand=True)
+        
+        self._refresh_leaderboard()
+    
     def _handle_sign_in(self):
         """
         处理签到操作，添加粒子爆炸动画
@@ -759,6 +801,7 @@ class SignInApp:
                 self._refresh_sign_status()
                 self._refresh_history()
                 self._refresh_stats_cards()
+                self._refresh_leaderboard()
             else:
                 messagebox.showinfo("提示", "您今日已签到！")
         except Exception as e:
@@ -950,6 +993,11 @@ class SignInApp:
             # 获取签到历史
             history = self.db.get_sign_history(self.current_user["user_id"], limit=30)
             
+            # 本月签到天数直接由签到位图得出，按用户所在时区的今天确定本月
+            today = self.db.user_today(self.current_user["user_id"])
+            month_days = self.db.get_sign_calendar(self.current_user["user_id"], today.year, today.month)
+            self.history_frame.config(text=f"签到历史（本月已签到{len(month_days)}天）")
+            
             # 添加到表格
             for record in history:
                 date = record["sign_date"]
@@ -968,6 +1016,29 @@ class SignInApp:
         except Exception as e:
             messagebox.showerror("错误", f"刷新签到历史失败：{str(e)}")
     
+    def _refresh_leaderboard(self):
+        """
+        刷新排行榜（未创建排行榜面板时不做任何事）
+        """
+        if not hasattr(self, 'leaderboard_tree'):
+            return
+        
+        for item in self.leaderboard_tree.get_children():
+            self.leaderboard_tree.delete(item)
+        
+        try:
+            by = self.leaderboard_by.get()
+            for entry in self.db.get_leaderboard(by, limit=10):
+                self.leaderboard_tree.insert("", tk.END, values=(entry.rank, entry.username, entry.streak))
+            
+            if self.current_user:
+                rank = self.db.get_user_rank(self.current_user["user_id"], by)["rank"]
+                self.my_rank_label.config(text=f"我的排名：第{rank}名" if rank else "我的排名：暂未上榜")
+            else:
+                self.my_rank_label.config(text="")
+        except Exception as e:
+            messagebox.showerror("错误", f"刷新排行榜失败：{str(e)}")
+    
     def __del__(self):
         """
         析构函数，关闭数据库连接
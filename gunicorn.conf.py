@@ -0,0 +1,33 @@
+"""
+gunicorn配置
+用法：gunicorn webapp:app（gunicorn会自动读取当前目录下的gunicorn.conf.py）
+
+- preload_app：主进程导入webapp时创建应用，数据库只初始化一次，没有配置SECRET_KEY时
+  各工作进程也共用主进程生成的随机密钥
+- 工作进程数默认为CPU核数*2+1，可用环境变量 WEB_CONCURRENCY 修改
+- 多个工作进程之间不共享内存，签到统计缓存默认改用数据库中的缓存表（STATS_CACHE=sqlite）
+"""
+
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = 60
+preload_app = True
+
+# 在导入webapp之前设置，进程内缓存在多个工作进程之间会读到旧统计
+os.environ.setdefault('STATS_CACHE', 'sqlite')
+
+
+def on_starting(server):
+    server.log.info("启动 %s 个工作进程，每个进程 %s 个线程", workers, threads)
+
+
+def post_fork(server, worker):
+    # 每个工作进程fork后打开自己的数据库连接、启动后台提醒线程（线程不会被fork复制）；
+    # 提醒线程通过锁文件互斥，同一时间只有一个工作进程执行提醒检查
+    from webapp import app, warm_up
+    warm_up(app)
+    server.log.info("工作进程 %s 预热完成", worker.pid)
@@ -0,0 +1,302 @@
+"""
+数据访问层性能统计（可选）
+开启后记录SignInDatabase每个方法的调用次数、错误次数、耗时分布和返回行数；
+开启explain时还会记录执行过的每种SQL语句，生成报告时用 EXPLAIN QUERY PLAN 查看执行计划，
+标记出需要全表扫描的语句。
+
+用法：
+    db = SignInDatabase(instrument=True)          # 或 instrument="explain"
+    ...
+    print(db.instrumentation.format_report())
+也可以设置环境变量 SIGNIN_INSTRUMENT=1（或 explain）开启，
+SIGNIN_INSTRUMENT_DUMP=文件路径 则在close()时把报告写入JSON文件，
+之后用 python manage.py profile --load 文件路径 查看。
+"""
+
+import functools
+import inspect
+import json
+import re
+import sqlite3
+import threading
+import time
+
+# 耗时分布的区间上限（毫秒），最后一档为超过最大上限的调用
+LATENCY_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+
+def normalize_sql(sql):
+    """
+    把SQL中的字面量替换为?，用于把同一种语句归为一类
+    :param sql: SQL语句
+    :return: 归一化后的语句
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\bX'[0-9A-Fa-f]*'", "?", sql)
+    sql = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(...)", sql)
+    return " ".join(sql.split())
+
+
+def table_aliases(sql):
+    """
+    找出语句中 FROM/JOIN 后面的表别名
+    :param sql: SQL语句
+    :return: {别名: 表名}
+    """
+    keywords = {'WHERE', 'ON', 'USING', 'JOIN', 'LEFT', 'INNER', 'CROSS', 'GROUP', 'ORDER',
+                'LIMIT', 'SET', 'WINDOW', 'UNION', 'NATURAL', 'OUTER', 'HAVING'}
+    aliases = {}
+    for table, alias in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.IGNORECASE):
+        if alias and alias.upper() not in keywords:
+            aliases[alias] = table
+    return aliases
+
+
+def count_rows(result):
+    """
+    估算方法返回的行数：列表/元组为长度，单条记录为1，None为0，其他类型不计
+    """
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    if isinstance(result, (bool, int, float, str, dict)):
+        return None
+    return 1
+
+
+class MethodStats:
+    """
+    单个方法的统计
+    """
+    __slots__ = ('calls', 'errors', 'total_ms', 'max_ms', 'rows', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, elapsed_ms, rows, error):
+        self.calls += 1
+        self.errors += 1 if error else 0
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += rows or 0
+        for index, limit in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= limit:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def to_dict(self):
+        labels = [f"<={limit}ms" for limit in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'rows': self.rows,
+            'histogram': {label: count for label, count in zip(labels, self.buckets) if count}
+        }
+
+
+class Instrumentation:
+    def __init__(self, explain=False):
+        """
+        初始化性能统计
+        :param explain: 是否记录执行过的SQL语句并在报告中给出执行计划，默认False
+        """
+        self.explain = explain
+        self._methods = {}
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, obj, names):
+        """
+        把对象的方法替换为带统计的版本（只影响该对象，不修改类）
+        :param obj: 被统计的对象
+        :param names: 方法名列表
+        """
+        for name in names:
+            method = getattr(obj, name)
+            if inspect.isgeneratorfunction(method):
+                setattr(obj, name, self._wrap_generator(name, method))
+            else:
+                setattr(obj, name, self._wrap_function(name, method))
+
+    def _wrap_function(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                self.record(name, (time.perf_counter() - start) * 1000, None, True)
+                raise
+            self.record(name, (time.perf_counter() - start) * 1000, count_rows(result), False)
+            return result
+        return wrapper
+
+    def _wrap_generator(self, name, method):
+        # 流式方法的耗时从开始迭代到迭代结束，行数为实际产出的记录数
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            rows = 0
+            error = False
+            try:
+                for row in method(*args, **kwargs):
+                    rows += 1
+                    yield row
+            except Exception:
+                error = True
+                raise
+            finally:
+                self.record(name, (time.perf_counter() - start) * 1000, rows, error)
+        return wrapper
+
+    def record(self, name, elapsed_ms, rows, error=False):
+        """
+        记录一次方法调用
+        :param name: 方法名
+        :param elapsed_ms: 耗时（毫秒）
+        :param rows: 返回行数，None表示不计
+        :param error: 是否出错
+        """
+        with self._lock:
+            stats = self._methods.get(name)
+            if stats is None:
+                stats = self._methods[name] = MethodStats()
+            stats.add(elapsed_ms, rows, error)
+
+    def attach(self, conn, pool):
+        """
+        为连接安装语句跟踪回调（开启explain时才生效），作为ConnectionPool的连接钩子使用
+        :param conn: sqlite3.Connection
+        :param pool: 连接所属的连接池，生成执行计划时使用
+        """
+        if self.explain:
+            conn.set_trace_callback(lambda sql: self._trace(pool, sql))
+
+    def _trace(self, pool, sql):
+        """
+        语句跟踪回调：按归一化后的语句计数，并保留一条带实际参数的样例用于EXPLAIN
+        """
+        sql = sql.strip()
+        # 触发器内的语句以注释形式报告，事务控制和建表语句没有执行计划
+        if not re.match(r"(SELECT|INSERT|UPDATE|DELETE|WITH|REPLACE)\b", sql, re.IGNORECASE):
+            return
+        if "sqlite_master" in sql:
+            return
+        key = normalize_sql(sql)
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                self._statements[key] = [1, sql, pool]
+            else:
+                entry[0] += 1
+
+    def explain_plans(self):
+        """
+        对记录到的每种语句执行 EXPLAIN QUERY PLAN
+        :return: 列表，每项包含statement、executions、plan、full_scans，按执行次数降序
+        """
+        with self._lock:
+            statements = [(key, entry[0], entry[1], entry[2]) for key, entry in self._statements.items()]
+
+        plans = []
+        tables_by_pool = {}
+        for key, executions, sample, pool in sorted(statements, key=lambda item: -item[1]):
+            conn = pool.connection()
+            if pool not in tables_by_pool:
+                tables_by_pool[pool] = {row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'"
+                )}
+            try:
+                plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sample)]
+            except sqlite3.Error as e:
+                plan = [f"无法获取执行计划: {e}"]
+            # 只标记对真实表的全表扫描（按索引扫描、CTE和子查询结果的扫描不算）；执行计划中显示的可能是别名
+            tables = table_aliases(sample)
+            full_scans = []
+            for detail in plan:
+                match = re.match(r"SCAN (\w+)", detail)
+                if match and tables.get(match.group(1), match.group(1)) in tables_by_pool[pool] \
+                        and "USING" not in detail:
+                    full_scans.append(detail)
+            plans.append({
+                'statement': key,
+                'executions': executions,
+                'plan': plan,
+                'full_scans': full_scans
+            })
+        return plans
+
+    def report(self):
+        """
+        生成统计报告
+        :return: 字典，methods为各方法统计，开启explain时statements为各语句的执行计划
+        """
+        with self._lock:
+            methods = {name: stats.to_dict() for name, stats in sorted(self._methods.items())}
+        report = {'methods': methods}
+        if self.explain:
+            report['statements'] = self.explain_plans()
+        return report
+
+    def format_report(self):
+        """
+        生成文本格式的统计报告
+        :return: 文本
+        """
+        return format_report(self.report())
+
+    def reset(self):
+        """
+        清空已记录的统计
+        """
+        with self._lock:
+            self._methods.clear()
+            self._statements.clear()
+
+    def dump(self, path):
+        """
+        把统计报告写入JSON文件
+        :param path: 文件路径
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+
+def format_report(report):
+    """
+    把统计报告格式化为文本
+    :param report: Instrumentation.report()的返回值
+    :return: 文本
+    """
+    lines = [f"{'方法':<28}{'调用':>8}{'错误':>6}{'平均ms':>10}{'最大ms':>10}{'总ms':>12}{'行数':>10}"]
+    methods = sorted(report['methods'].items(), key=lambda item: -item[1]['total_ms'])
+    for name, stats in methods:
+        lines.append(
+            f"{name:<28}{stats['calls']:>8}{stats['errors']:>6}{stats['avg_ms']:>10.3f}"
+            f"{stats['max_ms']:>10.3f}{stats['total_ms']:>12.3f}{stats['rows']:>10}"
+        )
+        lines.append(" " * 4 + "耗时分布: " + ", ".join(f"{label} {count}" for label, count in stats['histogram'].items()))
+
+    statements = report.get('statements')
+    if statements is not None:
+        scans = [item for item in statements if item['full_scans']]
+        lines.append("")
+        lines.append(f"共 {len(statements)} 种SQL语句，其中 {len(scans)} 种需要全表扫描")
+        for item in statements:
+            flag = "[全表扫描] " if item['full_scans'] else ""
+            lines.append(f"{flag}执行 {item['executions']} 次: {item['statement']}")
+            for detail in item['plan']:
+                lines.append(" " * 4 + detail)
+    return "\n".join(lines)
@@ -12,13 +12,19 @@ config.read('config.ini', encoding='utf-8')
 sender_email = config.get('Email', 'sender_email', fallback='')
 sender_password = config.get('Email', 'sender_password', fallback='')
 
+# 获取备份配置（backup_dir为空时不自动备份）
+backup_dir = config.get('Backup', 'backup_dir', fallback='')
+backup_keep = config.getint('Backup', 'keep', fallback=7)
+backup_time = config.get('Backup', 'time', fallback='03:00')
+
 # 完整版主应用，运行GUI和定时任务
 if __name__ == "__main__":
     try:
         print("启动每日签到提醒系统...")
         
         # 初始化并启动定时任务调度器
-        scheduler = SignInScheduler(sender_email, sender_password)
+        scheduler = SignInScheduler(sender_email, sender_password, backup_dir=backup_dir or None,
+                                    backup_keep=backup_keep, backup_time=backup_time)
         scheduler.start_scheduler()
         print(f"定时任务已启动，邮件发送器状态: {'已初始化' if scheduler.email_sender else '未初始化'}")
         
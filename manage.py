@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+维护命令行工具
+用法：python manage.py <命令> [参数]
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import sys
+
+from backup import BACKUP_DIR, BACKUP_KEEP, BACKUP_PAGES, BACKUP_SLEEP, backup_all
+from database import SignInDatabase, ARCHIVE_HORIZON_DAYS, date_to_day
+from export import EXPORT_DATASETS, EXPORT_FORMATS, export_to_file
+from instrumentation import format_report
+
+
+def cmd_rebuild_stats(args):
+    """
+    回填/重算用户统计表
+    """
+    db = SignInDatabase(args.db, shards=args.shards)
+    try:
+        count = db.rebuild_user_stats(args.user_id or None)
+        print(f"用户统计已重算，共 {count} 个用户")
+    finally:
+        db.close()
+
+
+def cmd_recompute_missed(args):
+    """
+    重算签到记录的连续未签到天数
+    """
+    db = SignInDatabase(args.db, shards=args.shards)
+    try:
+        changed = db.recompute_missed(args.user_id or None)
+        print(f"连续未签到天数已重算，修改了 {changed} 条签到记录")
+    finally:
+        db.close()
+
+
+def cmd_check_stats(args):
+    """
+    用签到位图校验用户统计表，列出不一致的用户
+    """
+    db = SignInDatabase(args.db, shards=args.shards)
+    try:
+        mismatched = 0
+        for user in db.iter_all_users():
+            expected = db.get_bitmap_streaks(user['user_id'])
+            actual = {
+                'current_streak': db.get_consecutive_sign_days(user['user_id']),
+                'longest_streak': db.get_longest_streak(user['user_id'])
+            }
+            if expected != actual:
+                mismatched += 1
+                print(f"用户 {user['username']} (ID: {user['user_id']}) 统计不一致: 统计表 {actual}，位图 {expected}")
+        print(f"校验完成，{mismatched} 个用户统计不一致")
+    finally:
+        db.close()
+
+
+def cmd_compact(args):
+    """
+    把保留期之前的签到记录折叠为按月汇总
+    """
+    db = SignInDatabase(args.db, shards=args.shards)
+    try:
+        removed, months = db.compact_sign_records(args.horizon_days)
+        print(f"归档完成，折叠签到记录 {removed} 条，写入月度汇总 {months} 行")
+    finally:
+        db.close()
+
+
+def cmd_purge(args):
+    """
+    批量删除用户及其全部签到数据
+    """
+    if not args.user_id and args.inactive_days is None:
+        print("请指定 --user-id 或 --inactive-days")
+        return
+    db = SignInDatabase(args.db, shards=args.shards)
+    try:
+        def report(deleted, total):
+            print(f"已删除 {deleted}/{total} 个用户")
+        
+        if args.user_id:
+            deleted = db.purge_users(args.user_id, chunk_size=args.chunk_size, progress=report)
+        else:
+            # 最近inactive_days天内没有签到（包括从未签到）的用户
+            cutoff = date_to_day(datetime.date.today()) - args.inactive_days
+            deleted = db.purge_users(
+                "user_id NOT IN (SELECT user_id FROM user_stats WHERE last_sign_date >= ?)", (cutoff,),
+                chunk_size=args.chunk_size, progress=report
+            )
+        print(f"清理完成，共删除 {deleted} 个用户")
+    finally:
+        db.close()
+
+
+def cmd_export(args):
+    """
+    流式导出用户、签到记录或用户统计
+    """
+    if args.output == "-":
+        # 导出内容写入标准输出，数据库连接等提示信息改为输出到标准错误，避免混入导出数据
+        output = sys.stdout.buffer
+        with contextlib.redirect_stdout(sys.stderr):
+            db = SignInDatabase(args.db, shards=args.shards)
+            try:
+                export_to_file(db.backend, output, args.dataset, args.format, args.gzip, args.chunk_size)
+                output.flush()
+            finally:
+                db.close()
+        return
+
+    db = SignInDatabase(args.db, shards=args.shards)
+    try:
+        with open(args.output, "wb") as f:
+            written = export_to_file(db.backend, f, args.dataset, args.format, args.gzip, args.chunk_size)
+        print(f"导出完成，写入 {args.output} 共 {written} 字节")
+    finally:
+        db.close()
+
+
+def cmd_backup(args):
+    """
+    在线备份数据库（所有分片）并轮换旧备份
+    """
+    db = SignInDatabase(args.db, shards=args.shards)
+    try:
+        for path in backup_all(db.backend, args.dir, args.keep, args.pages, args.sleep):
+            print(f"备份完成: {path}")
+    finally:
+        db.close()
+
+
+def cmd_profile(args):
+    """
+    执行一组典型的读操作并输出各方法的耗时统计（--explain 同时输出执行计划），
+    或用 --load 查看SIGNIN_INSTRUMENT_DUMP写出的统计文件
+    """
+    if args.load:
+        with open(args.load, encoding='utf-8') as f:
+            print(format_report(json.load(f)))
+        return
+
+    db = SignInDatabase(args.db, shards=args.shards, instrument="explain" if args.explain else True)
+    try:
+        today = datetime.date.today()
+        for _ in range(args.repeat):
+            users = db.get_all_users()
+            db.get_all_sign_records()
+            db.get_overdue_users()
+            db.get_leaderboard("current")
+            db.get_leaderboard("longest")
+            for user in users[:args.sample]:
+                db.get_user_by_id(user["user_id"])
+                db.get_user_by_username(user["username"])
+                db.get_sign_history(user["user_id"])
+                db.get_consecutive_sign_days(user["user_id"])
+                db.get_longest_streak(user["user_id"])
+                db.get_sign_calendar(user["user_id"], today.year, today.month)
+                db.get_user_rank(user["user_id"], "current")
+        print(db.instrumentation.format_report())
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="每日签到提醒系统维护工具")
+    parser.add_argument("--db", default="sign_in.db", help="数据库文件路径，默认sign_in.db")
+    parser.add_argument("--shards", type=int, default=1, help="分片数量，默认1（不分片）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = subparsers.add_parser("rebuild-stats", help="根据签到记录回填用户统计表")
+    rebuild_parser.add_argument("--user-id", type=int, action="append", help="只重算指定用户，可重复使用")
+    rebuild_parser.set_defaults(func=cmd_rebuild_stats)
+
+    missed_parser = subparsers.add_parser("recompute-missed", help="重算签到记录的连续未签到天数")
+    missed_parser.add_argument("--user-id", type=int, action="append", help="只重算指定用户，可重复使用")
+    missed_parser.set_defaults(func=cmd_recompute_missed)
+
+    check_parser = subparsers.add_parser("check-stats", help="用签到位图校验用户统计表")
+    check_parser.set_defaults(func=cmd_check_stats)
+
+    compact_parser = subparsers.add_parser("compact", help="把旧签到记录折叠为按月汇总")
+    compact_parser.add_argument("--horizon-days", type=int, default=ARCHIVE_HORIZON_DAYS,
+                                help=f"保留期（天），更早的完整月份会被归档，默认{ARCHIVE_HORIZON_DAYS}")
+    compact_parser.set_defaults(func=cmd_compact)
+
+    purge_parser = subparsers.add_parser("purge", help="分批删除用户及其签到数据")
+    purge_parser.add_argument("--user-id", type=int, action="append", help="要删除的用户ID，可重复使用")
+    purge_parser.add_argument("--inactive-days", type=int, help="删除最近N天内没有签到的用户")
+    purge_parser.add_argument("--chunk-size", type=int, default=500, help="每批删除的用户数，默认500")
+    purge_parser.set_defaults(func=cmd_purge)
+
+    export_parser = subparsers.add_parser("export", help="流式导出用户、签到记录或用户统计")
+    export_parser.add_argument("dataset", choices=EXPORT_DATASETS, help="导出的数据")
+    export_parser.add_argument("--format", default="csv", choices=EXPORT_FORMATS, help="导出格式，默认csv")
+    export_parser.add_argument("--gzip", action="store_true", help="gzip压缩输出")
+    export_parser.add_argument("--chunk-size", type=int, default=1000, help="每页读取的行数，默认1000")
+    export_parser.add_argument("-o", "--output", default="-", help="输出文件，默认写到标准输出")
+    export_parser.set_defaults(func=cmd_export)
+
+    backup_parser = subparsers.add_parser("backup", help="在线备份数据库，签到不需要停止")
+    backup_parser.add_argument("--dir", default=BACKUP_DIR, help=f"备份目录，默认{BACKUP_DIR}")
+    backup_parser.add_argument("--keep", type=int, default=BACKUP_KEEP, help=f"保留的备份数，默认{BACKUP_KEEP}")
+    backup_parser.add_argument("--pages", type=int, default=BACKUP_PAGES, help=f"每步复制的页数，默认{BACKUP_PAGES}")
+    backup_parser.add_argument("--sleep", type=float, default=BACKUP_SLEEP, help=f"每步之间暂停的秒数，默认{BACKUP_SLEEP}")
+    backup_parser.set_defaults(func=cmd_backup)
+
+    profile_parser = subparsers.add_parser("profile", help="统计各查询方法的耗时和执行计划")
+    profile_parser.add_argument("--explain", action="store_true", help="同时输出每种SQL语句的执行计划，标记全表扫描")
+    profile_parser.add_argument("--repeat", type=int, default=3, help="典型读操作的重复次数，默认3")
+    profile_parser.add_argument("--sample", type=int, default=50, help="按用户查询时抽取的用户数，默认50")
+    profile_parser.add_argument("--load", help="查看SIGNIN_INSTRUMENT_DUMP写出的统计文件")
+    profile_parser.set_defaults(func=cmd_profile)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+数据库查询结果的记录类型
+使用__slots__减少每条记录的内存占用，同时支持 record['字段名'] 的字典式访问，
+与原来返回字典的调用方式保持兼容。
+"""
+
+
+class Record:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        """
+        按字段名取值，字段不存在时返回默认值
+        """
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        """
+        返回全部字段名
+        """
+        return self.__slots__
+
+    def to_dict(self):
+        """
+        转换为字典
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class User(Record):
+    """
+    用户信息
+    """
+    __slots__ = ('user_id', 'username', 'email', 'phone', 'register_time', 'timezone')
+
+
+class SignRecord(Record):
+    """
+    签到记录
+    """
+    __slots__ = ('user_id', 'sign_date', 'consecutive_missed')
+
+
+class UserStatus(Record):
+    """
+    用户最近签到状态（用于定时检测）
+    """
+    __slots__ = ('user_id', 'username', 'email', 'phone', 'last_sign_date', 'consecutive_missed')
+
+
+class LeaderboardEntry(Record):
+    """
+    排行榜条目
+    """
+    __slots__ = ('rank', 'user_id', 'username', 'streak')
@@ -1,7 +1,8 @@
 import schedule
 import time
 import threading
-from database import SignInDatabase
+from database import SignInDatabase, local_now, local_today
+from backup import backup_all, BACKUP_KEEP
 from email_reminder import EmailReminder
 import datetime
 import logging
@@ -15,14 +16,23 @@ logging.basicConfig(
 )
 
 class SignInScheduler:
-    def __init__(self, email_sender=None, email_password=None):
+    def __init__(self, email_sender=None, email_password=None, db=None,
+                 backup_dir=None, backup_keep=BACKUP_KEEP, backup_time="03:00"):
         """
         初始化定时任务调度器
         :param email_sender: 发件人邮箱，用于发送提醒邮件
         :param email_password: 发件人邮箱授权码
+        :param db: 共享的SignInDatabase实例（可选），默认新建一个
+        :param backup_dir: 备份目录（可选），指定后每天自动在线备份数据库
+        :param backup_keep: 保留的备份数，默认7
+        :param backup_time: 每天执行备份的时间，默认凌晨3点
         """
-        self.db = SignInDatabase()
+        # SignInDatabase按线程分配连接，可以与GUI共用同一个实例
+        self.db = db or SignInDatabase()
         self.email_sender = None
+        self.backup_dir = backup_dir
+        self.backup_keep = backup_keep
+        self.backup_time = backup_time
         
         # 初始化邮件发送器（如果提供了邮箱配置）
         if email_sender and email_password:
@@ -33,21 +43,43 @@ class SignInScheduler:
                 logging.error(f"邮件发送器初始化失败: {e}")
                 self.email_sender = None
         
+        # 各时区最近一次检查的日期（该时区的今天），每个时区每天检查一次
+        self.checked_days = {}
+        
         self.is_running = False
         self.scheduler_thread = None
     
-    def _check_sign_status(self):
+    def _check_due_timezones(self):
+        """
+        每小时执行：检查刚刚过完一天的时区的用户
+        各时区的用户在当地午夜之后检查，全天的检查任务分散到24小时中
+        """
+        try:
+            for timezone in self.db.get_timezones():
+                today = local_today(timezone)
+                last_checked = self.checked_days.get(timezone)
+                if last_checked == today:
+                    continue
+                self.checked_days[timezone] = today
+                # 启动后新出现的时区（新用户）只在当地0点这一小时内检查，其余时间等到下一个午夜
+                if last_checked is None and local_now(timezone).hour != 0:
+                    continue
+                self._check_sign_status([timezone], today)
+        except Exception as e:
+            logging.error(f"执行分时区签到检查时出错: {e}")
+    
+    def _check_sign_status(self, timezones=None, as_of=None):
         """
-        检查所有用户的签到状态，发送提醒邮件
+        检查用户的签到状态，发送提醒邮件
+        :param timezones: 只检查这些时区的用户（None表示服务器本地时区），默认全部用户
+        :param as_of: 计算基准日期（datetime.date），默认今天
         """
-        logging.info("开始执行签到状态检查任务")
+        zone_names = ", ".join(timezone or "本地时区" for timezone in timezones) if timezones else "全部时区"
+        logging.info(f"开始执行签到状态检查任务（{zone_names}，基准日期 {as_of or datetime.date.today()}）")
         
         try:
-            # 获取所有用户的最新签到记录
-            all_users = self.db.get_all_sign_records()
-            today = datetime.date.today()
-            
-            for user in all_users:
+            # 只逐批读取连续未签到达到2天的用户
+            for user in self.db.iter_overdue_users(threshold_days=2, as_of=as_of, timezones=timezones):
                 try:
                     user_id = user['user_id']
                     username = user['username']
@@ -55,37 +87,32 @@ class SignInScheduler:
                     last_sign_date = user['last_sign_date']
                     consecutive_missed = user['consecutive_missed']
                     
-                    # 计算连续未签到天数
-                    if last_sign_date:
-                        # 转换为日期对象
-                        last_sign = datetime.datetime.strptime(last_sign_date, '%Y-%m-%d').date()
-                        days_diff = (today - last_sign).days
-                        
-                        # 如果最后签到日期不是今天，且不是昨天，更新连续未签到天数
-                        if days_diff > 1:
-                            consecutive_missed = days_diff - 1
-                    else:
-                        # 从未签到过
-                        consecutive_missed = 0
-                    
                     logging.info(f"检查用户: {username} (ID: {user_id})，最后签到日期: {last_sign_date}，连续未签到天数: {consecutive_missed}")
                     
                     # 如果连续2天未签到，发送提醒
                     if consecutive_missed >= 2:
                         # 检查用户是否有邮箱或电话
+                        # 发送前先在提醒记录表中领取发送权：本次连续未签到已提醒过（或其他进程正在提醒）时跳过
                         if email:
                             # 检查邮件发送器是否已初始化
-                            if self.email_sender:
-                                self._send_reminder_email(email, username, consecutive_missed)
+                            if not self.email_sender:
+                                logging.info(f"邮件发送器未初始化，跳过给用户 {username} (ID: {user_id}) 的邮件提醒")
+                            elif self.db.claim_reminder(user_id, last_sign_date, 'email'):
+                                sent = self._send_reminder_email(email, username, consecutive_missed)
+                                self.db.finish_reminder(user_id, last_sign_date, 'email', sent)
                                 logging.info(f"已发送提醒邮件给用户: {username} (ID: {user_id})")
                             else:
-                                logging.info(f"邮件发送器未初始化，跳过给用户 {username} (ID: {user_id}) 的邮件提醒")
+                                logging.info(f"本次连续未签到已提醒过用户 {username} (ID: {user_id})，跳过邮件提醒")
                         
                         phone = user['phone']
                         if phone:
-                            # 发送提醒短信
-                            self._send_reminder_sms(phone, username, consecutive_missed)
-                            logging.info(f"已发送提醒短信给用户: {username} (ID: {user_id})")
+                            if self.db.claim_reminder(user_id, last_sign_date, 'sms'):
+                                # 发送提醒短信
+                                sent = self._send_reminder_sms(phone, username, consecutive_missed)
+                                self.db.finish_reminder(user_id, last_sign_date, 'sms', sent)
+                                logging.info(f"已发送提醒短信给用户: {username} (ID: {user_id})")
+                            else:
+                                logging.info(f"本次连续未签到已提醒过用户 {username} (ID: {user_id})，跳过短信提醒")
                         
                         # 如果用户没有邮箱和电话，记录日志
                         if not email and not phone:
@@ -100,16 +127,29 @@ class SignInScheduler:
         except Exception as e:
             logging.error(f"执行签到状态检查任务时出错: {e}")
     
+    def _backup_database(self):
+        """
+        在线备份数据库并轮换旧备份
+        """
+        logging.info("开始执行数据库备份任务")
+        
+        try:
+            paths = backup_all(self.db.backend, self.backup_dir, self.backup_keep)
+            logging.info(f"数据库备份完成: {', '.join(paths)}")
+        except Exception as e:
+            logging.error(f"执行数据库备份任务时出错: {e}")
+    
     def _send_reminder_email(self, recipient_email, username, consecutive_days):
         """
         发送提醒邮件
         :param recipient_email: 收件人邮箱
         :param username: 用户名
         :param consecutive_days: 连续未签到天数
+        :return: 是否发送成功
         """
         if not self.email_sender:
             logging.error("邮件发送器未初始化，无法发送提醒邮件")
-            return
+            return False
         
         subject = "【签到提醒】您已连续多日未签到"
         content = f"""亲爱的 {username}：
@@ -130,8 +170,10 @@ class SignInScheduler:
                 logging.info(f"邮件发送成功: {recipient_email}")
             else:
                 logging.error(f"邮件发送失败: {recipient_email}，原因: {result['message']}")
+            return result['success']
         except Exception as e:
             logging.error(f"发送邮件时出错: {e}")
+            return False
     
     def _send_reminder_sms(self, phone_number, username, consecutive_days):
         """
@@ -139,6 +181,7 @@ class SignInScheduler:
         :param phone_number: 收件人手机号
         :param username: 用户名
         :param consecutive_days: 连续未签到天数
+        :return: 是否发送成功
         """
         try:
             logging.info(f"发送提醒短信给: {phone_number}，用户名: {username}，连续未签到: {consecutive_days}天")
@@ -152,8 +195,10 @@ class SignInScheduler:
                 logging.info(f"短信发送成功: {phone_number}，{result['message']}")
             else:
                 logging.error(f"短信发送失败: {phone_number}，{result['message']}")
+            return result['success']
         except Exception as e:
             logging.error(f"发送短信时出错: {e}")
+            return False
     
     def start_scheduler(self):
         """
@@ -164,9 +209,14 @@ class SignInScheduler:
             return
         
         try:
-            # 设置每天凌晨1点执行任务
-            schedule.every().day.at("01:00").do(self._check_sign_status)
-            logging.info("定时任务已设置为每天凌晨1点执行")
+            # 每小时整点检查一次，处理刚过当地午夜的时区
+            self._mark_checked_today()
+            schedule.every().hour.at(":00").do(self._check_due_timezones)
+            logging.info("定时任务已设置为每小时执行，各时区的用户在当地午夜后检查")
+            
+            if self.backup_dir:
+                schedule.every().day.at(self.backup_time).do(self._backup_database)
+                logging.info(f"数据库备份已设置为每天{self.backup_time}执行，备份目录: {self.backup_dir}")
             
             # 立即执行一次检查（用于测试）
             # self._check_sign_status()
@@ -210,12 +260,26 @@ class SignInScheduler:
         
         logging.info("定时任务已停止")
     
+    def _mark_checked_today(self):
+        """
+        启动时把各时区标记为今天已检查，启动时不立即检查；
+        当地还在0点这一小时内的时区标记为昨天，下一个整点检查
+        """
+        try:
+            for timezone in self.db.get_timezones():
+                now = local_now(timezone)
+                checked = now.date() - datetime.timedelta(days=1) if now.hour == 0 else now.date()
+                self.checked_days[timezone] = checked
+        except Exception as e:
+            logging.error(f"读取用户时区时出错: {e}")
+    
     def manual_check(self):
         """
-        手动触发一次签到状态检查
+        手动触发一次签到状态检查（各时区按当地的今天计算）
         """
         logging.info("手动触发签到状态检查")
-        self._check_sign_status()
+        for timezone in self.db.get_timezones():
+            self._check_sign_status([timezone], local_today(timezone))
 
 # 测试代码
 if __name__ == "__main__":
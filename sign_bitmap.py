@@ -0,0 +1,156 @@
+"""
+签到位图引擎
+每个用户每年的签到情况用一个366位的位图表示：第i位为1表示当年第i天（从0开始）已签到。
+位图以46字节的BLOB（小端序）存储，计算时转换为Python整数做位运算。
+"""
+
+import datetime
+
+# 366位向上取整到字节
+YEAR_BYTES = 46
+
+
+def day_index(date):
+    """
+    获取日期在当年中的位序号
+    :param date: datetime.date
+    :return: 从0开始的当年天数序号
+    """
+    return date.timetuple().tm_yday - 1
+
+
+def days_in_year(year):
+    """
+    获取某年的天数
+    :param year: 年份
+    :return: 365或366
+    """
+    return (datetime.date(year + 1, 1, 1) - datetime.date(year, 1, 1)).days
+
+
+def to_int(blob):
+    """
+    把位图BLOB转换为整数
+    :param blob: bytes，可以为None
+    :return: 整数位图
+    """
+    return int.from_bytes(blob, 'little') if blob else 0
+
+
+def to_blob(bits):
+    """
+    把整数位图转换为BLOB
+    :param bits: 整数位图
+    :return: 46字节的bytes
+    """
+    return bits.to_bytes(YEAR_BYTES, 'little')
+
+
+def trailing_run(bits, index):
+    """
+    计算以第index位结尾（向前）的连续1的个数
+    :param bits: 整数位图
+    :param index: 结束位序号
+    :return: 连续1的个数
+    """
+    mask = (1 << (index + 1)) - 1
+    gaps = ~bits & mask
+    # 最高的0位之后都是连续的1
+    return index + 1 - gaps.bit_length()
+
+
+def leading_run(bits):
+    """
+    计算从第0位开始的连续1的个数
+    :param bits: 整数位图
+    :return: 连续1的个数
+    """
+    return (~bits & (bits + 1)).bit_length() - 1
+
+
+def longest_run(bits):
+    """
+    计算位图中最长的连续1的个数
+    每次 bits &= bits >> 1 都会把每段连续1缩短一位，循环次数即最长段的长度
+    :param bits: 整数位图
+    :return: 最长连续1的个数
+    """
+    length = 0
+    while bits:
+        bits &= bits >> 1
+        length += 1
+    return length
+
+
+def current_streak(year_bits, as_of):
+    """
+    计算截至as_of（含）的连续签到天数
+    :param year_bits: {年份: 整数位图}
+    :param as_of: datetime.date
+    :return: 连续签到天数，as_of当天未签到时为0
+    """
+    year = as_of.year
+    index = day_index(as_of)
+    streak = 0
+    while True:
+        run = trailing_run(year_bits.get(year, 0), index)
+        streak += run
+        if run < index + 1:
+            return streak
+        # 连续段延伸到了年初，继续检查上一年的年末
+        year -= 1
+        if year not in year_bits:
+            return streak
+        index = days_in_year(year) - 1
+
+
+def longest_streak(year_bits):
+    """
+    计算所有年份中最长的连续签到天数（跨年的连续段会被合并）
+    :param year_bits: {年份: 整数位图}
+    :return: 最长连续签到天数
+    """
+    longest = 0
+    carry = 0
+    previous_year = None
+    for year in sorted(year_bits):
+        bits = year_bits[year]
+        size = days_in_year(year)
+        if previous_year != year - 1:
+            carry = 0
+        head = leading_run(bits)
+        if head >= size:
+            # 全年每天都签到，连续段继续延伸到下一年
+            carry += size
+            longest = max(longest, carry)
+        else:
+            longest = max(longest, carry + head, longest_run(bits))
+            carry = trailing_run(bits, size - 1)
+        previous_year = year
+    return longest
+
+
+def signed_days(bits, year, month=None):
+    """
+    列出某年（或某月）已签到的日期
+    :param bits: 整数位图
+    :param year: 年份
+    :param month: 月份（可选），默认整年
+    :return: 已签到日期列表，按日期升序
+    """
+    if month is None:
+        start = datetime.date(year, 1, 1)
+        end = datetime.date(year + 1, 1, 1)
+    else:
+        start = datetime.date(year, month, 1)
+        end = datetime.date(year + month // 12, month % 12 + 1, 1)
+    first = day_index(start)
+    count = (end - start).days
+    window = (bits >> first) & ((1 << count) - 1)
+
+    days = []
+    while window:
+        low = window & -window
+        days.append(start + datetime.timedelta(days=low.bit_length() - 1))
+        window ^= low
+    return days
@@ -0,0 +1,295 @@
+"""
+存储后端
+SignInDatabase通过存储后端获取数据库连接：
+- SQLiteBackend：单个SQLite文件
+- ShardedSQLiteBackend：按用户ID把数据分散到N个SQLite文件，每个文件各有一把写锁，
+  写入吞吐量可以随分片数增长
+"""
+
+import os
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """
+    按线程分配SQLite连接的连接池
+    每个线程持有自己的连接，连接使用WAL日志模式，读操作不会阻塞写操作
+    """
+    
+    def __init__(self, db_path, timeout=30.0):
+        """
+        初始化连接池
+        :param db_path: 数据库文件路径
+        :param timeout: 等待写锁的超时时间（秒），默认30秒
+        """
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._hooks = []
+        self._lock = threading.Lock()
+    
+    def connection(self):
+        """
+        获取当前线程的数据库连接，不存在时创建
+        :return: sqlite3.Connection
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None：由transaction()显式控制事务边界
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # 外键约束默认关闭，需按连接开启，删除用户时才会级联删除其签到数据
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+                hooks = list(self._hooks)
+            for hook in hooks:
+                hook(conn)
+        return conn
+    
+    def add_connection_hook(self, hook):
+        """
+        注册连接钩子：对已有连接立即调用，之后新建的连接在创建时调用
+        :param hook: 接受sqlite3.Connection的函数
+        """
+        with self._lock:
+            self._hooks.append(hook)
+            connections = list(self._connections)
+        for conn in connections:
+            hook(conn)
+    
+    @contextmanager
+    def cursor(self):
+        """
+        获取一个短生命周期的游标，用于只读查询
+        """
+        cursor = self.connection().cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+    
+    @contextmanager
+    def transaction(self):
+        """
+        在写事务中执行操作，正常结束时提交，出现异常时回滚
+        已处于事务中时直接复用当前事务
+        """
+        conn = self.connection()
+        cursor = conn.cursor()
+        if conn.in_transaction:
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+            return
+        
+        # BEGIN IMMEDIATE：开始时即获取写锁，避免读事务升级为写事务时死锁
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    
+    def close_all(self):
+        """
+        关闭连接池中所有线程的连接
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+class StorageBackend:
+    """
+    存储后端接口
+    按用户的操作通过pool_for_user/pool_for_username路由到一个连接池，
+    面向全部用户的查询通过map_shards在所有连接池上执行
+    """
+    
+    def pools(self):
+        """
+        获取全部连接池，按分片序号排列
+        :return: ConnectionPool列表
+        """
+        raise NotImplementedError
+    
+    def shard_of(self, user_id):
+        """
+        获取用户所在的分片序号
+        :param user_id: 用户ID
+        :return: 分片序号
+        """
+        raise NotImplementedError
+    
+    def shard_of_username(self, username):
+        """
+        获取新用户应写入的分片序号
+        :param username: 用户名
+        :return: 分片序号
+        """
+        raise NotImplementedError
+    
+    def allocate_user_id(self, cursor, username):
+        """
+        为新用户分配用户ID，需在目标分片的写事务中调用
+        :param cursor: 目标分片的数据库游标
+        :param username: 用户名
+        :return: 用户ID，返回None表示使用表的自增ID
+        """
+        return None
+    
+    def pool_for_user(self, user_id):
+        """
+        获取用户所在分片的连接池
+        :param user_id: 用户ID
+        :return: ConnectionPool
+        """
+        return self.pools()[self.shard_of(user_id)]
+    
+    def pool_for_username(self, username):
+        """
+        获取新用户应写入的分片的连接池
+        :param username: 用户名
+        :return: ConnectionPool
+        """
+        return self.pools()[self.shard_of_username(username)]
+    
+    def map_shards(self, func):
+        """
+        在每个分片上执行func(pool)
+        :param func: 接收ConnectionPool的函数
+        :return: 按分片序号排列的结果列表
+        """
+        return [func(pool) for pool in self.pools()]
+    
+    @contextmanager
+    def identity_lock(self):
+        """
+        添加用户、修改用户名/邮箱/电话期间持有的锁，用于跨分片检查唯一性
+        单文件后端由表的唯一约束保证，不需要加锁
+        """
+        yield
+    
+    def close_all(self):
+        """
+        关闭全部连接
+        """
+        for pool in self.pools():
+            pool.close_all()
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    单文件存储后端
+    """
+    
+    def __init__(self, db_path, timeout=30.0):
+        """
+        :param db_path: 数据库文件路径
+        :param timeout: 等待写锁的超时时间（秒）
+        """
+        self.pool = ConnectionPool(db_path, timeout)
+    
+    def pools(self):
+        return [self.pool]
+    
+    def shard_of(self, user_id):
+        return 0
+    
+    def shard_of_username(self, username):
+        return 0
+
+
+class ShardedSQLiteBackend(StorageBackend):
+    """
+    按用户分片的存储后端
+    第k个分片中的用户ID满足 user_id % 分片数 == k，按用户ID即可定位分片；
+    新用户按用户名的CRC32哈希选择分片。
+    表的唯一约束只在单个分片内生效，用户名、邮箱、电话的全局唯一性由调用方在identity_lock()中
+    检查所有分片来保证。
+    """
+    
+    def __init__(self, db_paths, timeout=30.0):
+        """
+        :param db_paths: 各分片的数据库文件路径列表
+        :param timeout: 等待写锁的超时时间（秒）
+        """
+        if not db_paths:
+            raise ValueError("分片数量不能为0")
+        self._pools = [ConnectionPool(path, timeout) for path in db_paths]
+        self._executor = None
+        self._executor_lock = threading.Lock()
+    
+    @classmethod
+    def from_path(cls, db_path, shard_count, timeout=30.0):
+        """
+        根据基础路径生成分片文件名，例如 sign_in.db -> sign_in.shard0.db、sign_in.shard1.db ...
+        :param db_path: 基础数据库文件路径
+        :param shard_count: 分片数量
+        :param timeout: 等待写锁的超时时间（秒）
+        :return: ShardedSQLiteBackend
+        """
+        root, ext = os.path.splitext(db_path)
+        return cls([f"{root}.shard{i}{ext or '.db'}" for i in range(shard_count)], timeout)
+    
+    def pools(self):
+        return self._pools
+    
+    def shard_of(self, user_id):
+        return user_id % len(self._pools)
+    
+    def shard_of_username(self, username):
+        return zlib.crc32(username.encode('utf-8')) % len(self._pools)
+    
+    def allocate_user_id(self, cursor, username):
+        shard_count = len(self._pools)
+        shard = self.shard_of_username(username)
+        # sqlite_sequence记录了本分片用过的最大用户ID，在此基础上递增一个分片数
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'users'")
+        row = cursor.fetchone()
+        if row and row[0]:
+            return row[0] + shard_count
+        return shard or shard_count
+    
+    @contextmanager
+    def identity_lock(self):
+        # 以第一个分片的写事务作为锁，其他进程添加用户时同样会等待；
+        # 在锁内写入第一个分片时会复用这个事务，随锁一起提交
+        with self._pools[0].transaction():
+            yield
+    
+    def map_shards(self, func):
+        # 各分片并行执行，每个工作线程从连接池取得自己的连接
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=len(self._pools), thread_name_prefix="shard"
+                )
+        return list(self._executor.map(func, self._pools))
+    
+    def close_all(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        super().close_all()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试脚本：从旧版webapp建的数据库升级到当前表结构
+可直接运行（python test_migration.py），也可以用pytest运行
+"""
+
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import SCHEMA_VERSION, SignInDatabase, date_to_day
+
+# 旧版webapp的建表语句：sign_date为TEXT，没有 (user_id, sign_date) 唯一约束
+BASELINE_WEBAPP_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT,
+    phone TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS sign_records (
+    record_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    sign_date TEXT NOT NULL,
+    sign_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    consecutive_missed INTEGER DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+'''
+
+
+def create_baseline_db(path):
+    """
+    按旧版webapp的表结构建库并写入几条签到记录
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_WEBAPP_SCHEMA)
+    conn.execute("INSERT INTO users (username, email) VALUES ('alice', 'alice@example.com')")
+    conn.executemany(
+        "INSERT INTO sign_records (user_id, sign_date) VALUES (1, ?)",
+        [('2026-10-01',), ('2026-10-02',), ('2026-10-04',)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_upgrade_baseline_webapp_db():
+    """
+    旧版webapp数据库升级后：签到日期为整数天数，统计和连续未签到天数正确
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sign_in.db")
+        create_baseline_db(path)
+
+        db = SignInDatabase(path)
+        try:
+            assert db.get_longest_streak(1) == 2
+        finally:
+            db.close()
+
+        conn = sqlite3.connect(path)
+        try:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+            rows = conn.execute(
+                "SELECT sign_date, typeof(sign_date), consecutive_missed FROM sign_records ORDER BY sign_date"
+            ).fetchall()
+            days = [date_to_day(d) for d in ('2026-10-01', '2026-10-02', '2026-10-04')]
+            assert rows == [(days[0], 'integer', 0), (days[1], 'integer', 0), (days[2], 'integer', 1)]
+        finally:
+            conn.close()
+
+        # 再次打开不会重复迁移
+        SignInDatabase(path).close()
+
+
+def test_duplicate_sign_records():
+    """
+    升级时删除重复的签到记录；之后重复导入同一天（包括已归档的日期）或导入不存在的用户的记录不会再插入
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sign_in.db")
+        create_baseline_db(path)
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT INTO sign_records (user_id, sign_date) VALUES (1, '2026-10-02')")
+        conn.commit()
+        conn.close()
+
+        db = SignInDatabase(path)
+        try:
+            assert len(db.get_sign_history(1, limit=100)) == 3
+            assert db.add_sign_records_bulk([(1, '2026-10-02'), (1, '2026-10-02')]) == 0
+            # 归档2026年10月之后，再导入该月已签到的日期也会被跳过
+            db.compact_sign_records(horizon_days=0, as_of=datetime.date(2026, 11, 15))
+            assert db.add_sign_records_bulk([(1, '2026-10-04'), (1, '2026-10-05')]) == 1
+            assert len(db.get_sign_history(1, limit=100)) == 4
+            # 用户不存在（或已被清理）的记录被跳过，其余记录照常导入
+            assert db.add_sign_records_bulk([(1, '2026-10-06'), (99, '2026-10-06')]) == 1
+            assert len(db.get_sign_history(1, limit=100)) == 5
+        finally:
+            db.close()
+
+        conn = sqlite3.connect(path)
+        try:
+            assert conn.execute("SELECT MIN(consecutive_missed) FROM sign_records").fetchone()[0] >= 0
+        finally:
+            conn.close()
+
+
+def main():
+    """
+    主测试函数
+    """
+    print("=== 测试旧版webapp数据库升级 ===")
+    test_upgrade_baseline_webapp_db()
+    test_duplicate_sign_records()
+    print("数据库升级测试成功")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试脚本：网页版的会话和签到统计缓存
+可直接运行（python test_webapp.py），也可以用pytest运行
+"""
+
+import os
+import sys
+import tempfile
+
+# 测试中不启动后台提醒线程
+os.environ.setdefault('REMINDER_WORKER', '0')
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import webapp
+from database import SignInDatabase
+
+
+def login_and_sign_in(client):
+    """
+    输入授权码、保存用户信息并签到
+    """
+    client.post("/", data={"code": webapp.AUTHORIZATION_CODE})
+    client.post("/home", data={"action": "save_user", "username": "alice", "email": "alice@example.com"})
+    response = client.post("/home", data={"action": "sign_in"})
+    assert response.status_code == 200
+
+
+def test_purged_user_with_sqlite_cache():
+    """
+    会话中的用户被清理后，使用数据库缓存时查看主页跳转到登录页，不写入缓存
+    """
+    stats_cache = webapp.stats_cache
+    webapp.stats_cache = webapp.SQLiteStatsCache()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sign_in.db")
+            app = webapp.create_app({"DATABASE": path, "SECRET_KEY": "test"})
+            client = app.test_client()
+            login_and_sign_in(client)
+
+            db = SignInDatabase(path)
+            try:
+                assert db.purge_users([1], pause=0) == 1
+            finally:
+                db.close()
+
+            response = client.get("/home")
+            assert response.status_code == 302
+            assert response.headers["Location"].endswith("/")
+            with client.session_transaction() as session:
+                assert "user_id" not in session
+            with app.app_context():
+                assert webapp.get_db().execute("SELECT COUNT(*) FROM stats_cache").fetchone()[0] == 0
+                # 用户已不存在时失效缓存也不会写入
+                webapp.invalidate_stats_cache(1)
+                assert webapp.get_db().execute("SELECT COUNT(*) FROM stats_cache").fetchone()[0] == 0
+    finally:
+        webapp.stats_cache = stats_cache
+
+
+def test_app_in_module_dir():
+    """
+    模块中的app在第一次访问时才创建，但dir(webapp)中能找到（部分WSGI加载方式据此查找入口）
+    """
+    assert "app" in dir(webapp)
+
+
+def main():
+    """
+    主测试函数
+    """
+    print("=== 测试网页版 ===")
+    test_purged_user_with_sqlite_cache()
+    test_app_in_module_dir()
+    print("网页版测试成功")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,28 @@
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import (Flask, Blueprint, Response, current_app, jsonify, render_template, request, redirect, url_for,
+                   session, g, stream_with_context)
 import sqlite3
 import datetime
+import json
 import os
+import threading
 import smtplib
+try:
+    import fcntl
+except ImportError:
+    # Windows没有fcntl，不做进程间互斥
+    fcntl = None
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from database import (upgrade_schema, record_sign_in, fetch_dashboard_stats, fetch_user_today, date_to_day,
+                      local_now, local_today, earliest_today, validate_timezone, expire_stale_streaks, fetch_leaderboard,
+                      fetch_user_streak, count_users_above, fetch_timezones, overdue_users_query,
+                      claim_reminder, finish_reminder, fetch_stats_version)
+from storage import SQLiteBackend
+from group_commit import GroupCommitWriter
+from export import EXPORT_DATASETS, EXPORT_FORMATS, iter_export
+from cache import LRUCache
 
-app = Flask(__name__)
-app.secret_key = os.urandom(24)  # 用于会话加密
+bp = Blueprint("main", __name__)
 
 # 授权码
 AUTHORIZATION_CODE = "LYY996"
@@ -37,9 +52,47 @@ else:
     DATABASE = os.path.join(os.getcwd(), "sign_in.db")
 print(f"数据库路径: {DATABASE}")
 
-# 初始化数据库
-def init_db():
-    conn = sqlite3.connect(DATABASE)
+# 会话加密密钥：多个工作进程必须使用同一个密钥，否则在一个进程登录后，另一个进程不认这个会话
+# 优先使用环境变量 SECRET_KEY，其次是config.ini中[Web]的secret_key
+SECRET_KEY = os.environ.get('SECRET_KEY') or config.get('Web', 'secret_key', fallback='')
+
+# 组提交签到（可选）：设置环境变量 GROUP_COMMIT=1 后，签到由后台写线程批量提交
+# GROUP_COMMIT_DURABILITY 可选 OFF/NORMAL/FULL，默认FULL
+GROUP_COMMIT = os.environ.get('GROUP_COMMIT') == '1'
+GROUP_COMMIT_DURABILITY = os.environ.get('GROUP_COMMIT_DURABILITY', 'FULL')
+_sign_in_writer = None
+_sign_in_writer_lock = threading.Lock()
+
+# 最近一次清理过期连续天数的日期（整数天数），每天只需清理一次
+_streaks_expired_on = None
+
+# 未签到提醒由后台线程定时检查，不在页面请求中执行
+# REMINDER_INTERVAL 为检查间隔（秒），默认3600；REMINDER_WORKER=0 时不启动（如Vercel等无常驻进程的环境）
+REMINDER_WORKER = os.environ.get('REMINDER_WORKER', '1') != '0'
+REMINDER_INTERVAL = float(os.environ.get('REMINDER_INTERVAL', 3600))
+_reminder_worker = None
+_reminder_worker_lock = threading.Lock()
+
+# 每个工作进程的每个线程复用自己的数据库连接，不在每个请求中重新打开
+_db_local = threading.local()
+
+# 主页签到统计缓存：STATS_CACHE=lru（默认，进程内LRU）、sqlite（数据库中的缓存表，多个工作进程共用）或off（不缓存）
+# STATS_CACHE_SIZE 为进程内缓存的用户数，默认10000
+STATS_CACHE = os.environ.get('STATS_CACHE', 'lru')
+STATS_CACHE_SIZE = int(os.environ.get('STATS_CACHE_SIZE', 10000))
+
+# 初始化数据库（应用启动时执行一次）
+def init_db(database):
+    # 确保数据库目录存在
+    db_dir = os.path.dirname(database)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+        print(f"创建数据库目录: {db_dir}")
+    
+    conn = sqlite3.connect(database)
+    # WAL模式下多个工作进程的读请求不会被签到写入阻塞（该设置保存在数据库文件中）
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
     cursor = conn.cursor()
     
     # 创建用户表
@@ -49,7 +102,8 @@ def init_db():
         username TEXT NOT NULL UNIQUE,
         email TEXT,
         phone TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        timezone TEXT
     )
     ''')
     
@@ -58,85 +112,182 @@ def init_db():
     CREATE TABLE IF NOT EXISTS sign_records (
         record_id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
-        sign_date TEXT NOT NULL,
+        sign_date INTEGER NOT NULL,
         sign_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         consecutive_missed INTEGER DEFAULT 0,
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
     )
     ''')
     
-    conn.commit()
-    conn.close()
-
-# 检查用户是否已签到
-def is_signed_in_today(user_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+    # 创建索引和用户统计表，并迁移旧版本的签到日期格式
+    upgrade_schema(cursor)
     
-    today = datetime.date.today().strftime("%Y-%m-%d")
-    cursor.execute("SELECT * FROM sign_records WHERE user_id = ? AND sign_date = ?", (user_id, today))
-    result = cursor.fetchone()
+    # 创建签到统计缓存表（STATS_CACHE=sqlite时使用），每个用户一行
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_cache (
+        user_id INTEGER PRIMARY KEY,
+        day INTEGER,
+        snapshot TEXT,
+        generation INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    )
+    ''')
     
+    conn.commit()
     conn.close()
-    return result is not None
 
-# 获取连续未签到天数
-def get_consecutive_missed_days(user_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # 获取最近的签到记录
-    cursor.execute("SELECT sign_date FROM sign_records WHERE user_id = ? ORDER BY sign_date DESC", (user_id,))
-    records = cursor.fetchall()
-    
-    today = datetime.date.today()
-    
-    if not records:
-        # 如果没有签到记录，检查当前日期是否是系统启用后的第一天
-        return 0
-    
-    # 获取最近一次签到日期
-    last_sign_date = datetime.datetime.strptime(records[0][0], "%Y-%m-%d").date()
-    
-    # 计算从最后一次签到到今天的天数差
-    days_diff = (today - last_sign_date).days
-    
-    # 如果今天已经签到，未签到天数为0
-    if is_signed_in_today(user_id):
-        return 0
+# 获取组提交写入器（首次使用时启动写线程）
+def get_sign_in_writer():
+    global _sign_in_writer
+    with _sign_in_writer_lock:
+        if _sign_in_writer is None:
+            _sign_in_writer = GroupCommitWriter(SQLiteBackend(current_app.config["DATABASE"]),
+                                                durability=GROUP_COMMIT_DURABILITY)
+        return _sign_in_writer
+
+# 获取当前请求的数据库连接：当前线程第一次使用时打开，之后的请求继续使用
+def get_db():
+    if "db" not in g:
+        # fork出的工作进程不能使用主进程打开的连接，进程号变化时重新打开
+        if getattr(_db_local, "pid", None) != os.getpid():
+            _db_local.pid = os.getpid()
+            _db_local.connections = {}
+        database = current_app.config["DATABASE"]
+        conn = _db_local.connections.get(database)
+        if conn is None:
+            conn = sqlite3.connect(database, timeout=30)
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _db_local.connections[database] = conn
+        g.db = conn
+    return g.db
+
+# 请求结束时回滚未提交的事务，连接留给下一个请求使用
+def close_db(exception=None):
+    db = g.pop("db", None)
+    if db is not None and db.in_transaction:
+        db.rollback()
+
+# 一次查询获取主页需要的全部签到统计，用户不存在（已删除或已清理）时返回None
+def get_dashboard_snapshot(user_id):
+    # 用户时区和统计在同一次查询中读取，按用户所在时区计算今天
+    result = fetch_dashboard_stats(get_db().cursor(), user_id)
+    if result is None:
+        return None
+    today, stats = result
     
-    # 连续未签到天数 = 天数差 - 1（因为当天还没结束）
-    consecutive_missed = days_diff
+    if not stats:
+        return {
+            "signed_in_today": False,
+            "consecutive_days": 0,
+            "longest_streak": 0,
+            "consecutive_missed": 0,
+            "total_signs": 0,
+            "last_sign_date": None
+        }
     
-    conn.close()
-    return consecutive_missed
+    signed_in_today = stats["last_sign_date"] == today
+    return {
+        "signed_in_today": signed_in_today,
+        # 最近一次签到不是今天时，连续签到已中断
+        "consecutive_days": stats["current_streak"] if signed_in_today else 0,
+        "longest_streak": stats["longest_streak"],
+        # 从最后一次签到到今天的天数差（今天已签到时为0）
+        "consecutive_missed": (today - stats["last_sign_date"]).days,
+        "total_signs": stats["total_signs"],
+        "last_sign_date": stats["last_sign_date"]
+    }
 
-# 获取连续签到天数
-def get_consecutive_days(user_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+# 进程内的签到统计缓存，每个用户一个条目，记录计算时的日期
+# 读取前记下失效代数，期间发生过失效（签到、保存用户信息）时丢弃这次写入
+class LRUStatsCache:
+    def __init__(self, maxsize):
+        self.cache = LRUCache(maxsize, ttl=None)
     
-    # 获取最近的签到记录
-    cursor.execute("SELECT sign_date FROM sign_records WHERE user_id = ? ORDER BY sign_date DESC", (user_id,))
-    records = cursor.fetchall()
+    # 返回(统计, 失效代数)，日期不是day时视为未命中
+    def get(self, user_id, day):
+        generation = self.cache.generation()
+        entry = self.cache.get(user_id)
+        if entry is not None and entry[0] == day:
+            return entry[1], generation
+        return None, generation
     
-    if not records:
-        return 0
+    def put(self, user_id, day, snapshot, generation):
+        self.cache.put(user_id, (day, snapshot), generation)
     
-    consecutive = 0
-    today = datetime.date.today()
+    def invalidate(self, user_id):
+        self.cache.invalidate(user_id)
+
+# 数据库中的签到统计缓存，多个工作进程共用，任何进程签到后其他进程都不会再读到旧统计
+# 每个用户一行，generation在每次失效时加1；写入时generation变了说明期间发生过失效，不写入
+class SQLiteStatsCache:
+    def get(self, user_id, day):
+        row = get_db().execute(
+            "SELECT day, snapshot, generation FROM stats_cache WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None, None
+        if row[0] == day and row[1] is not None:
+            snapshot = json.loads(row[1])
+            if snapshot["last_sign_date"]:
+                snapshot["last_sign_date"] = datetime.date.fromisoformat(snapshot["last_sign_date"])
+            return snapshot, row[2]
+        return None, row[2]
     
-    for record in records:
-        sign_date = datetime.datetime.strptime(record[0], "%Y-%m-%d").date()
-        expected_date = today - datetime.timedelta(days=consecutive)
-        
-        if sign_date == expected_date:
-            consecutive += 1
-        else:
-            break
+    def put(self, user_id, day, snapshot, generation):
+        last_sign_date = snapshot["last_sign_date"]
+        data = json.dumps(dict(snapshot, last_sign_date=last_sign_date.isoformat() if last_sign_date else None))
+        conn = get_db()
+        # 读取时没有缓存行（generation为None）而现在有了，或generation已变化，都说明期间发生过失效
+        # 用户已被删除时不写入（缓存表引用users，写入会违反外键约束）
+        conn.execute("""
+            INSERT INTO stats_cache (user_id, day, snapshot, generation)
+            SELECT user_id, ?, ?, 0 FROM users WHERE user_id = ?
+            ON CONFLICT(user_id) DO UPDATE SET day = excluded.day, snapshot = excluded.snapshot
+            WHERE stats_cache.generation IS ?
+        """, (day, data, user_id, generation))
+        conn.commit()
     
-    conn.close()
-    return consecutive
+    def invalidate(self, user_id):
+        conn = get_db()
+        conn.execute("""
+            INSERT INTO stats_cache (user_id, generation)
+            SELECT user_id, 1 FROM users WHERE user_id = ?
+            ON CONFLICT(user_id) DO UPDATE SET snapshot = NULL, generation = generation + 1
+        """, (user_id,))
+        conn.commit()
+
+if STATS_CACHE == "sqlite":
+    stats_cache = SQLiteStatsCache()
+elif STATS_CACHE == "off":
+    stats_cache = None
+else:
+    stats_cache = LRUStatsCache(STATS_CACHE_SIZE)
+
+# 用户所在时区的今天（整数天数），会话中记有该用户的时区时不需要查询数据库
+def get_user_day(user_id):
+    if session.get("user_id") == user_id and "timezone" in session:
+        return date_to_day(local_today(session["timezone"]))
+    return date_to_day(fetch_user_today(get_db().cursor(), user_id))
+
+# 带缓存的签到统计：统计只在签到时变化，同一天内重复查看直接使用缓存
+# 缓存条目记录计算时用户所在时区的日期，跨天后不再命中，连续签到是否中断会重新计算
+# 用户不存在时返回None，不写入缓存
+def get_cached_snapshot(user_id):
+    if stats_cache is None:
+        return get_dashboard_snapshot(user_id)
+    day = get_user_day(user_id)
+    snapshot, generation = stats_cache.get(user_id, day)
+    if snapshot is None:
+        snapshot = get_dashboard_snapshot(user_id)
+        if snapshot is not None:
+            stats_cache.put(user_id, day, snapshot, generation)
+    return snapshot
+
+# 签到或修改用户信息后删除该用户的缓存统计
+def invalidate_stats_cache(user_id):
+    if stats_cache is not None:
+        stats_cache.invalidate(user_id)
 
 # 发送短信函数
 def send_sms(to_phone, body):
@@ -212,90 +363,112 @@ def send_email(to_email, subject, body):
         print(f"邮件发送失败: 其他错误 - {str(e)}")
         return False
 
-# 检查所有用户并发送未签到提醒
-def check_and_send_reminders():
+# 检查所有用户并发送未签到提醒（由后台线程调用，使用自己的数据库连接）
+def check_and_send_reminders(database):
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # 获取所有用户
-        cursor.execute("SELECT user_id, username, email, phone FROM users")
-        users = cursor.fetchall()
-        
-        for user in users:
-            user_id, username, email, phone = user
-            
-            # 计算连续未签到天数
-            consecutive_missed = get_consecutive_missed_days(user_id)
+        conn = sqlite3.connect(database, timeout=30)
+        conn.execute("PRAGMA foreign_keys=ON")
+        try:
+            cursor = conn.cursor()
+            overdue = []
+            # 按时区分组，各组按当地的今天计算；在最近签到日期索引上只查出逾期用户
+            # 距离最后一次签到满2天（即至少错过了昨天）时提醒
+            for timezone in fetch_timezones(cursor):
+                cursor.execute(*overdue_users_query(1, local_today(timezone), [timezone]))
+                overdue.extend(cursor.fetchall())
             
-            print(f"检查用户 {username}: 连续未签到 {consecutive_missed} 天")
-            
-            # 如果连续两天未签到，发送提醒
-            if consecutive_missed >= 2:
-                print(f"用户 {username} 连续 {consecutive_missed} 天未签到，发送提醒")
+            for user_id, username, email, phone, last_sign_date, missed in overdue:
+                consecutive_missed = missed + 1
+                # 本次连续未签到从最后一次签到的第二天开始，每个渠道只提醒一次
+                episode_start = last_sign_date + 1
                 
                 # 发送内容
                 subject = "紧急提醒 - 活着吗"
                 body = f"您的好友{username}已连续 {consecutive_missed} 天未签到。\n\n发送时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
                 
                 # 发送邮件和短信（只发送已配置的联系方式）
-                if email:
-                    send_email(email, subject, body)
-                if phone:
-                    send_sms(phone, body)
-        
-        conn.close()
+                # 发送前先提交一条领取记录，其他进程或下一次检查看到记录后不会重复发送
+                for channel, contact, send in (("email", email, lambda: send_email(email, subject, body)),
+                                               ("sms", phone, lambda: send_sms(phone, body))):
+                    if not contact:
+                        continue
+                    claimed = claim_reminder(cursor, user_id, episode_start, channel)
+                    conn.commit()
+                    if not claimed:
+                        continue
+                    print(f"用户 {username} 连续 {consecutive_missed} 天未签到，发送{channel}提醒")
+                    finish_reminder(cursor, user_id, episode_start, channel, send())
+                    conn.commit()
+        finally:
+            conn.close()
     except Exception as e:
         print(f"检查并发送提醒失败: {str(e)}")
 
-# 获取最长连续签到天数
-def get_longest_streak(user_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # 获取所有签到日期，按日期排序
-    cursor.execute("SELECT sign_date FROM sign_records WHERE user_id = ? ORDER BY sign_date", (user_id,))
-    records = cursor.fetchall()
+# 后台提醒线程：启动后立即检查一次，之后每隔REMINDER_INTERVAL秒检查一次
+# 多个进程（如gunicorn的多个工作进程）中只有持有锁文件（数据库路径.reminder.lock）的进程执行检查，
+# 该进程退出后锁自动释放，其他进程在下一次检查时接替
+class ReminderWorker(threading.Thread):
+    def __init__(self, database, interval):
+        super().__init__(name="reminder-worker", daemon=True)
+        self.database = database
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._lock_file = None
     
-    if not records:
-        return 0
-    
-    longest_streak = 1
-    current_streak = 1
+    # 尝试获取锁文件，获取后一直持有到进程退出
+    def _acquire_lock(self):
+        if fcntl is None or self._lock_file is not None:
+            return True
+        lock_file = open(self.database + ".reminder.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
     
-    for i in range(1, len(records)):
-        prev_date = datetime.datetime.strptime(records[i-1][0], "%Y-%m-%d").date()
-        curr_date = datetime.datetime.strptime(records[i][0], "%Y-%m-%d").date()
-        
-        if (curr_date - prev_date).days == 1:
-            current_streak += 1
-            longest_streak = max(longest_streak, current_streak)
-        else:
-            current_streak = 1
+    def run(self):
+        while not self._stop_event.is_set():
+            if self._acquire_lock():
+                check_and_send_reminders(self.database)
+            self._stop_event.wait(self.interval)
     
-    conn.close()
-    return longest_streak
+    def stop(self):
+        self._stop_event.set()
+
+# 启动后台提醒线程（每个进程只启动一个，多个进程之间由锁文件保证只有一个进程执行检查）
+def start_reminder_worker(database):
+    global _reminder_worker
+    with _reminder_worker_lock:
+        if _reminder_worker is None and REMINDER_WORKER:
+            _reminder_worker = ReminderWorker(database, REMINDER_INTERVAL)
+            _reminder_worker.start()
+        return _reminder_worker
+
+# 由WSGI服务器加载时没有经过__main__，在第一个请求时启动提醒线程
+@bp.before_app_request
+def ensure_reminder_worker():
+    if _reminder_worker is None:
+        start_reminder_worker(current_app.config["DATABASE"])
 
 # 授权码验证页面
-@app.route("/", methods=["GET", "POST"])
+@bp.route("/", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         code = request.form.get("code")
         if code == AUTHORIZATION_CODE:
             session["authorized"] = True
-            return redirect(url_for("home"))
+            return redirect(url_for(".home"))
         else:
             return render_template("login.html", error="授权码错误")
     return render_template("login.html")
 
 # 主页面
-@app.route("/home", methods=["GET", "POST"])
+@bp.route("/home", methods=["GET", "POST"])
 def home():
     if not session.get("authorized"):
-        return redirect(url_for("login"))
-    
-    # 检查所有用户并发送未签到提醒
-    check_and_send_reminders()
+        return redirect(url_for(".login"))
     
     # 检查用户是否已登录
     user_id = session.get("user_id")
@@ -308,9 +481,14 @@ def home():
     signed_in_today = False
     
     if user_id:
-        consecutive_days = get_consecutive_days(user_id)
-        longest_streak = get_longest_streak(user_id)
-        signed_in_today = is_signed_in_today(user_id)
+        snapshot = get_cached_snapshot(user_id)
+        if snapshot is None:
+            # 会话中的用户已被删除（如被manage.py purge清理），重新登录
+            session.clear()
+            return redirect(url_for(".login"))
+        consecutive_days = snapshot["consecutive_days"]
+        longest_streak = snapshot["longest_streak"]
+        signed_in_today = snapshot["signed_in_today"]
     
     if request.method == "POST":
         action = request.form.get("action")
@@ -321,28 +499,19 @@ def home():
                 username = request.form.get("username")
                 email = request.form.get("email")
                 phone = request.form.get("phone")
+                # 时区由浏览器自动填写，无法识别时按服务器本地时区处理
+                try:
+                    timezone = validate_timezone(request.form.get("timezone"))
+                except ValueError:
+                    timezone = None
                 
                 if not username or not (email or phone):
                     return render_template("home.html", username=username, email=email, phone=phone, error="用户名不能为空，邮箱和电话至少填写一个")
                 
                 print(f"保存用户信息: username={username}, email={email}, phone={phone}")
-                print(f"数据库路径: {DATABASE}")
-                
-                # 确保数据库目录存在
-                db_dir = os.path.dirname(DATABASE)
-                if db_dir and not os.path.exists(db_dir):
-                    os.makedirs(db_dir)
-                    print(f"创建数据库目录: {db_dir}")
                 
-                # 确保数据库表存在
-                print("调用init_db()")
-                init_db()
-                print("init_db()调用完成")
-                
-                print("连接数据库")
-                conn = sqlite3.connect(DATABASE)
+                conn = get_db()
                 cursor = conn.cursor()
-                print("数据库连接成功")
                 
                 # 检查用户是否已存在
                 print(f"检查用户是否存在: {username}")
@@ -353,37 +522,38 @@ def home():
                 if existing_user:
                     # 更新用户信息
                     print(f"更新用户信息: user_id={existing_user[0]}, email={email}, phone={phone}")
-                    cursor.execute("UPDATE users SET email = ?, phone = ? WHERE user_id = ?", (email, phone, existing_user[0]))
+                    cursor.execute("UPDATE users SET email = ?, phone = ?, timezone = COALESCE(?, timezone) WHERE user_id = ?", (email, phone, timezone, existing_user[0]))
                     user_id = existing_user[0]
                     print(f"更新成功")
                 else:
                     # 添加新用户
                     print(f"添加新用户: username={username}, email={email}, phone={phone}")
-                    cursor.execute("INSERT INTO users (username, email, phone) VALUES (?, ?, ?)", (username, email, phone))
+                    cursor.execute("INSERT INTO users (username, email, phone, timezone) VALUES (?, ?, ?, ?)", (username, email, phone, timezone))
                     user_id = cursor.lastrowid
                     print(f"插入成功，user_id={user_id}")
                 
                 print("提交事务")
                 conn.commit()
                 print("事务提交成功")
-                conn.close()
-                print("数据库连接关闭")
                 
-                # 更新会话
+                # 时区可能改变，按新的时区重新计算统计
+                invalidate_stats_cache(user_id)
+                
+                # 更新会话（记下时区，之后查看主页时不需要查询数据库就能确定用户的今天）
                 session["user_id"] = user_id
                 session["username"] = username
                 session["email"] = email
                 session["phone"] = phone
+                session["timezone"] = cursor.execute("SELECT timezone FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
                 print(f"会话更新成功: user_id={user_id}")
                 
                 # 刷新数据
                 print("刷新数据")
-                consecutive_days = get_consecutive_days(user_id)
-                print(f"连续天数: {consecutive_days}")
-                longest_streak = get_longest_streak(user_id)
-                print(f"最长连续: {longest_streak}")
-                signed_in_today = is_signed_in_today(user_id)
-                print(f"今日已签到: {signed_in_today}")
+                snapshot = get_cached_snapshot(user_id)
+                consecutive_days = snapshot["consecutive_days"]
+                longest_streak = snapshot["longest_streak"]
+                signed_in_today = snapshot["signed_in_today"]
+                print(f"连续天数: {consecutive_days}, 最长连续: {longest_streak}, 今日已签到: {signed_in_today}")
                 
                 return render_template("home.html", username=username, email=email, phone=phone, consecutive_days=consecutive_days, longest_streak=longest_streak, signed_in_today=signed_in_today, success="用户信息已保存")
             except Exception as e:
@@ -404,23 +574,24 @@ def home():
                 if signed_in_today:
                     return render_template("home.html", username=username, email=email, phone=phone, consecutive_days=consecutive_days, longest_streak=longest_streak, signed_in_today=signed_in_today, error="您今日已签到")
                 
-                # 确保数据库表存在
-                init_db()
-                
-                conn = sqlite3.connect(DATABASE)
-                cursor = conn.cursor()
-                
-                # 添加签到记录
-                today = datetime.date.today().strftime("%Y-%m-%d")
-                cursor.execute("INSERT INTO sign_records (user_id, sign_date) VALUES (?, ?)", (user_id, today))
-                
-                conn.commit()
-                conn.close()
+                if GROUP_COMMIT:
+                    # 交给写线程与其他签到一起提交
+                    get_sign_in_writer().sign_in(user_id, timeout=30)
+                else:
+                    conn = get_db()
+                    cursor = conn.cursor()
+                    
+                    # 按用户所在时区的今天添加签到记录（同时计算连续未签到天数），并在同一事务中更新用户统计和签到位图
+                    record_sign_in(cursor, user_id)
+                    
+                    conn.commit()
                 
                 # 刷新数据
-                consecutive_days = get_consecutive_days(user_id)
-                longest_streak = get_longest_streak(user_id)
-                signed_in_today = True
+                invalidate_stats_cache(user_id)
+                snapshot = get_cached_snapshot(user_id)
+                consecutive_days = snapshot["consecutive_days"]
+                longest_streak = snapshot["longest_streak"]
+                signed_in_today = snapshot["signed_in_today"]
                 
                 return render_template("home.html", username=username, email=email, phone=phone, consecutive_days=consecutive_days, longest_streak=longest_streak, signed_in_today=signed_in_today, success="签到成功")
             except Exception as e:
@@ -460,20 +631,232 @@ def home():
     
     return render_template("home.html", username=username, email=email, phone=phone, consecutive_days=consecutive_days, longest_streak=longest_streak, signed_in_today=signed_in_today)
 
+# 每天第一次查看排行榜时，把已中断的当前连续天数清零
+def expire_streaks_once(today):
+    global _streaks_expired_on
+    if _streaks_expired_on != today:
+        conn = get_db()
+        expire_stale_streaks(conn.cursor(), today)
+        conn.commit()
+        _streaks_expired_on = today
+
+# 获取用户的排名（连续天数为0时不参与排名）
+def get_user_rank(user_id, by):
+    cursor = get_db().cursor()
+    streak = fetch_user_streak(cursor, user_id, by)
+    if streak == 0:
+        return None
+    return 1 + count_users_above(cursor, streak, by)
+
+# 排行榜页面
+@bp.route("/leaderboard")
+def leaderboard():
+    if not session.get("authorized"):
+        return redirect(url_for(".login"))
+    
+    # 按最早的时区判断连续签到是否中断，避免清零其他时区还在延续的连续签到
+    today = date_to_day(earliest_today())
+    expire_streaks_once(today)
+    
+    cursor = get_db().cursor()
+    current_board = fetch_leaderboard(cursor, "current", 10, today)
+    longest_board = fetch_leaderboard(cursor, "longest", 10, today)
+    
+    user_id = session.get("user_id")
+    current_rank = get_user_rank(user_id, "current") if user_id else None
+    longest_rank = get_user_rank(user_id, "longest") if user_id else None
+    
+    return render_template("leaderboard.html", username=session.get("username", ""), current_board=current_board, longest_board=longest_board, current_rank=current_rank, longest_rank=longest_rank)
+
+# JSON接口的身份验证：已登录的会话，或在请求头 X-Authorization-Code 中带上授权码（供快捷指令、小组件使用）
+# 用户取会话中的用户，或参数user_id（查询参数、表单或JSON）
+def get_api_user_id():
+    if not session.get("authorized") and request.headers.get("X-Authorization-Code") != AUTHORIZATION_CODE:
+        return None, (jsonify({"error": "未授权"}), 401)
+    user_id = session.get("user_id")
+    if user_id is None:
+        data = request.get_json(silent=True) or {}
+        user_id = request.values.get("user_id", data.get("user_id"))
+    try:
+        return int(user_id), None
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": "请先保存用户信息或指定user_id"}), 400)
+
+# 签到接口：重复签到不会报错，already_signed_in为true
+@bp.route("/api/v1/sign-in", methods=["POST"])
+def api_sign_in():
+    user_id, error = get_api_user_id()
+    if error:
+        return error
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    if fetch_stats_version(cursor, user_id) is None:
+        return jsonify({"error": "用户不存在"}), 404
+    
+    try:
+        if GROUP_COMMIT:
+            record_id = get_sign_in_writer().sign_in(user_id, timeout=30)
+        else:
+            record_id = record_sign_in(cursor, user_id)
+            conn.commit()
+    except Exception as e:
+        print(f"签到错误: {str(e)}")
+        return jsonify({"error": "签到失败，请稍后重试"}), 500
+    
+    invalidate_stats_cache(user_id)
+    snapshot = get_cached_snapshot(user_id)
+    return jsonify({
+        "user_id": user_id,
+        "already_signed_in": record_id is None,
+        "consecutive_days": snapshot["consecutive_days"],
+        "longest_streak": snapshot["longest_streak"]
+    }), 200 if record_id is None else 201
+
+# 签到状态接口：今天是否已签到、已连续多少天未签到
+@bp.route("/api/v1/status")
+def api_status():
+    user_id, error = get_api_user_id()
+    if error:
+        return error
+    
+    if fetch_stats_version(get_db().cursor(), user_id) is None:
+        return jsonify({"error": "用户不存在"}), 404
+    snapshot = get_cached_snapshot(user_id)
+    return jsonify({
+        "user_id": user_id,
+        "signed_in_today": snapshot["signed_in_today"],
+        # 从最后一次签到到今天的天数差，从未签到时为null
+        "consecutive_missed": snapshot["consecutive_missed"] if snapshot["last_sign_date"] else None
+    })
+
+# 签到统计接口：带ETag和Last-Modified，统计没有变化时返回304
+# 统计只在签到（或重算统计）和用户所在时区跨天时变化，版本号由这两者组成，判断是否变化只需读取一行中的两列
+@bp.route("/api/v1/stats")
+def api_stats():
+    user_id, error = get_api_user_id()
+    if error:
+        return error
+    
+    cursor = get_db().cursor()
+    version = fetch_stats_version(cursor, user_id)
+    if version is None:
+        return jsonify({"error": "用户不存在"}), 404
+    timezone, updated_at = version
+    
+    now = local_now(timezone)
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    etag = f"{user_id}-{updated_at or 0}-{date_to_day(now.date())}"
+    last_modified = max(datetime.datetime.fromtimestamp(updated_at or 0, datetime.timezone.utc), midnight)
+    
+    if request.if_none_match.contains(etag) or (
+            not request.if_none_match and request.if_modified_since
+            and request.if_modified_since >= last_modified.replace(microsecond=0)):
+        response = Response(status=304)
+    else:
+        snapshot = get_cached_snapshot(user_id)
+        last_sign_date = snapshot["last_sign_date"]
+        response = jsonify({
+            "user_id": user_id,
+            "date": now.date().isoformat(),
+            "signed_in_today": snapshot["signed_in_today"],
+            "consecutive_days": snapshot["consecutive_days"],
+            "longest_streak": snapshot["longest_streak"],
+            "total_signs": snapshot["total_signs"],
+            "last_sign_date": last_sign_date.isoformat() if last_sign_date else None
+        })
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # 客户端可以缓存，但每次使用前都要带上ETag重新验证
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# 导出数据：按页读取并边读边发送，大数据量时内存占用也不会增长
+# 参数：dataset=users/sign_records/stats，format=csv/ndjson，gzip=1 压缩
+@bp.route("/export")
+def export():
+    if not session.get("authorized"):
+        return redirect(url_for(".login"))
+    
+    dataset = request.args.get("dataset", "sign_records")
+    fmt = request.args.get("format", "csv")
+    compress = request.args.get("gzip") == "1"
+    if dataset not in EXPORT_DATASETS or fmt not in EXPORT_FORMATS:
+        return "导出参数错误", 400
+    
+    filename = f"{dataset}.{fmt}" + (".gz" if compress else "")
+    mimetype = "application/gzip" if compress else ("text/csv" if fmt == "csv" else "application/x-ndjson")
+    backend = SQLiteBackend(current_app.config["DATABASE"])
+    
+    def generate():
+        try:
+            yield from iter_export(backend, dataset, fmt, compress)
+        finally:
+            backend.close_all()
+    
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
 # 退出登录
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     session.clear()
-    return redirect(url_for("login"))
+    return redirect(url_for(".login"))
 
-if __name__ == "__main__":
-    init_db()
+# 创建应用
+# config为覆盖默认配置的字典，可设置DATABASE（数据库路径）、SECRET_KEY（会话密钥）、INIT_DB（是否在创建时初始化数据库）
+# 由gunicorn启动时（preload_app）在主进程中创建一次，数据库只初始化一次，工作进程fork后直接使用
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(DATABASE=DATABASE, SECRET_KEY=SECRET_KEY, INIT_DB=True)
+    if config:
+        app.config.update(config)
+    if not app.config["SECRET_KEY"]:
+        # 没有配置密钥时使用随机密钥：重启后需要重新登录，多个工作进程只有在fork前创建应用时才共用密钥
+        print("未配置SECRET_KEY，使用随机会话密钥")
+        app.config["SECRET_KEY"] = os.urandom(24)
+    
+    app.register_blueprint(bp)
+    app.teardown_appcontext(close_db)
     
-    # 启动时检查所有用户并发送未签到提醒
-    check_and_send_reminders()
+    if app.config["INIT_DB"]:
+        init_db(app.config["DATABASE"])
+    return app
+
+# 工作进程预热：fork之后打开本进程的数据库连接并读取一次表结构，启动后台提醒线程，
+# 第一个请求不需要再等待这些初始化
+def warm_up(app):
+    with app.app_context():
+        get_db().execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        start_reminder_worker(app.config["DATABASE"])
+
+# gunicorn等WSGI服务器使用模块中的app（webapp:app）：第一次访问时才创建应用并初始化数据库，
+# 只导入本模块（如脚本中引用其中的函数）不会在当前目录创建数据库文件
+# Vercel等通过dir(模块)查找app的加载方式也能找到app（见__dir__）
+_app = None
+_app_lock = threading.Lock()
+
+def __getattr__(name):
+    global _app
+    if name == "app":
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | {"app"})
+
+if __name__ == "__main__":
+    app = create_app()
     
     # 生产环境配置
     port = int(os.environ.get('PORT', 5000))
     host = os.environ.get('HOST', '0.0.0.0')
     debug = os.environ.get('FLASK_ENV') != 'production'
+    
+    # 启动后台提醒线程（启动时立即检查一次）；调试模式的重载器父进程不处理请求，不需要启动
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_reminder_worker(app.config["DATABASE"])
     app.run(host=host, port=port, debug=debug)